@@ -0,0 +1,65 @@
+"""Benchmark of the contour point histograms of image_processing_stage_2 on a 3000x2000 synthetic table scan,
+against the original implementation that deduplicated points through a set and counted them in dicts.
+
+Run from the repository root:
+    python -m benchmarks.contour_histogram
+"""
+import time
+
+import numpy as np
+
+from src import image_processing
+from src import image_processing_stage_2
+from benchmarks import synthetic
+
+
+def original_get_contour_point_frequencies(larger_contours):
+    points = set()
+    max_x = 0; max_y = 0
+    x_frequencies_dict = {}; y_frequencies_dict = {}
+
+    for contour in larger_contours:
+        for point in contour:
+            x = point[0][0] # for some reason a 'point' is nested inside an array
+            y = point[0][1]
+            if (x,y) in points: continue # avoid duplicates
+            points.add((x,y))
+            if x not in x_frequencies_dict.keys(): x_frequencies_dict[x] = 1
+            else: x_frequencies_dict[x] += 1
+            if y not in y_frequencies_dict.keys(): y_frequencies_dict[y] = 1
+            else: y_frequencies_dict[y] += 1
+            max_x = max(max_x,x)
+            max_y = max(max_y,y)
+
+    x_frequencies = []; y_frequencies = []
+    for _ in range(0,max_x+1): x_frequencies.append(0)
+    for _ in range(0,max_y+1): y_frequencies.append(0)
+
+    for value in x_frequencies_dict.keys(): x_frequencies[value] = x_frequencies_dict[value]
+    for value in y_frequencies_dict.keys(): y_frequencies[value] = y_frequencies_dict[value]
+    return x_frequencies, y_frequencies
+
+
+def main():
+    image = synthetic.make_table_scan(3000, 2000)
+    larger_contours,_ = image_processing.get_larger_contours_from_image(image)
+    print(f'{sum(len(contour) for contour in larger_contours)} contour points in {len(larger_contours)} larger contours')
+
+    start = time.perf_counter()
+    expected_x, expected_y = original_get_contour_point_frequencies(larger_contours)
+    original_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    x_frequencies, y_frequencies = image_processing_stage_2.get_contour_point_frequencies(larger_contours)
+    vectorized_seconds = time.perf_counter() - start
+
+    identical_histograms = np.array_equal(expected_x, x_frequencies) and np.array_equal(expected_y, y_frequencies)
+    identical_lines = (image_processing_stage_2.get_table_lines(expected_x, image.shape, True) == image_processing_stage_2.get_table_lines(x_frequencies, image.shape, True)
+                       and image_processing_stage_2.get_table_lines(expected_y, image.shape, False) == image_processing_stage_2.get_table_lines(y_frequencies, image.shape, False))
+    print(f'original   : {original_seconds*1000:10.1f} ms')
+    print(f'vectorized : {vectorized_seconds*1000:10.1f} ms  ({original_seconds/vectorized_seconds:.0f}x faster)')
+    print(f'identical histograms: {identical_histograms}, identical lines: {identical_lines}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""Benchmark of image_processing.get_larger_contours_from_image on 3000x2000 synthetic table scans:
+how its time splits between Canny, findContours and the selection of the larger contours,
+and the selection against a version vectorized over the concatenated contour points (same output, for comparison).
+
+Run from the repository root:
+    python -m benchmarks.contour_selection
+"""
+import time
+
+import numpy as np
+import cv2
+
+from src import image_processing
+from benchmarks import synthetic
+
+
+def vectorized_select_larger_contours(contours, image_area, min_ratio_of_image_area=0.00086):
+    """Areas (shoelace formula) and bounding rects of all the contours in one pass over their concatenated points,
+    then only the contours that the original loop would keep are sorted."""
+    lengths = np.array([len(contour) for contour in contours])
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    points = np.concatenate([contour.reshape(-1,2) for contour in contours]).astype(np.int64)
+    x = points[:,0]; y = points[:,1]
+    next_indexes = np.arange(1, len(points)+1)
+    next_indexes[starts + lengths - 1] = starts
+    areas = np.abs(np.add.reduceat(x*y[next_indexes] - x[next_indexes]*y, starts)) / 2
+    widths = np.maximum.reduceat(x, starts) - np.minimum.reduceat(x, starts) + 1
+    heights = np.maximum.reduceat(y, starts) - np.minimum.reduceat(y, starts) + 1
+    large_enough = widths*heights/image_area >= min_ratio_of_image_area
+
+    candidates = np.flatnonzero(large_enough)
+    if not large_enough.all():
+        too_small = np.flatnonzero(~large_enough)
+        first_too_small = too_small[np.argmax(areas[too_small])]
+        stop_area = areas[first_too_small]
+        candidate_areas = areas[candidates]
+        candidates = candidates[(candidate_areas > stop_area) | ((candidate_areas == stop_area) & (candidates < first_too_small))]
+    return [contours[i] for i in candidates[np.argsort(-areas[candidates], kind='stable')]]
+
+
+def best_of(repeats, function, *args):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(*args)
+        seconds = time.perf_counter() - start
+        if best is None or seconds < best: best = seconds
+    return result, best
+
+
+def main():
+    for seed in range(3):
+        image = synthetic.make_table_scan(3000, 2000, seed=seed)
+        image_area = image.shape[0] * image.shape[1]
+        edged, canny_seconds = best_of(5, cv2.Canny, image, 30, 180)
+        (all_contours,_), find_seconds = best_of(5, cv2.findContours, edged, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
+        larger_contours, select_seconds = best_of(20, image_processing.select_larger_contours, all_contours, image_area)
+        vectorized_contours, vectorized_seconds = best_of(20, vectorized_select_larger_contours, all_contours, image_area)
+
+        identical = len(vectorized_contours) == len(larger_contours) and all(a is b for a,b in zip(vectorized_contours, larger_contours))
+        print(f'seed {seed}: {len(larger_contours)} of {len(all_contours)} contours selected ({sum(len(contour) for contour in all_contours)} points)')
+        print(f'  Canny             : {canny_seconds*1000:8.1f} ms')
+        print(f'  findContours      : {find_seconds*1000:8.1f} ms')
+        print(f'  selection         : {select_seconds*1000:8.1f} ms')
+        print(f'  vectorized select : {vectorized_seconds*1000:8.1f} ms  (identical output: {identical})')
+
+
+if __name__ == '__main__':
+    main()
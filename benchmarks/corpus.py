@@ -0,0 +1,227 @@
+"""Offline benchmark of the whole pipeline (image processing stages and OCR) over a local corpus of fixture documents.
+No scraping and no network - so that every performance change to image_processing_stage_* or tesseract_interface can be judged on both speed and accuracy.
+
+The corpus is a folder of PDFs (*.pdf) and/or table images (*.png, *.jpg, *.jpeg). Ground truth for a document goes in a csv file
+with the same name (eg: 2024-05-06.pdf and 2024-05-06.csv), with the same columns as the output csv files
+(country, country code, currency, currency code, exchange rate). Documents without ground truth are timed but don't count towards the detection rate.
+A country-exchangerate pair is detected if the output has a row with the same country and the same exchange rate.
+
+Reports throughput (docs/s, cells/s), latency percentiles of each stage, peak memory and the detection rate, and writes them to a JSON file
+that later runs can be compared against.
+
+Run from the repository root:
+    python -m benchmarks.corpus --make-synthetic 10          # make a synthetic corpus (table images + ground truth) if you have no fixtures
+    python -m benchmarks.corpus --output baseline.json       # record a baseline
+    python -m benchmarks.corpus --compare baseline.json      # after a change, compare against it
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import time
+import traceback
+from datetime import datetime
+
+import cv2
+
+import config
+from src import metrics
+from src import pipeline
+from src import get_table_image
+from src import output
+
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def load_ground_truth(csv_path: str) -> list[tuple[str,str]]:
+    """(country, exchange rate) pairs of a ground truth (or output) csv file/string."""
+    with open(csv_path, 'rt', newline='') as f: return get_pairs(f.read())
+
+
+def get_pairs(csv_string: str) -> list[tuple[str,str]]:
+    pairs = []
+    for row in csv.reader(io.StringIO(csv_string)):
+        if len(row) < 5: continue
+        pairs.append((normalize_country(row[0]), normalize_rate(row[4])))
+    return pairs
+
+
+def normalize_country(country: str) -> str:
+    return ' '.join(country.lower().split())
+
+
+def normalize_rate(rate: str) -> str:
+    try: return f'{float(rate):.4f}'
+    except ValueError: return rate.strip()
+
+
+def detection_rate(truth: list[tuple[str,str]], detected: list[tuple[str,str]]) -> float:
+    detected = set(detected)
+    if len(truth) == 0: return None
+    return sum(1 for pair in truth if pair in detected) / len(truth)
+
+
+def percentiles(values: list[float]) -> dict:
+    values = sorted(values)
+    def percentile(p):
+        return values[min(len(values)-1, round(p/100*(len(values)-1)))]
+    return {'p50': percentile(50), 'p90': percentile(90), 'p99': percentile(99), 'max': values[-1], 'mean': sum(values)/len(values)}
+
+
+def run_document(path: str) -> tuple[str,metrics.DocumentMetrics]:
+    """Runs the pipeline on one fixture. Returns the csv string (None if it failed) and the metrics."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    document_metrics = metrics.DocumentMetrics(name)
+    try:
+        start = time.perf_counter()
+        if path.lower().endswith('.pdf'):
+            with open(path, 'rb') as f: rows = pipeline.process_pdf(name, io.BytesIO(f.read()), document_metrics)
+        else:
+            with document_metrics.stage('decode'): base_image = cv2.imread(path, cv2.IMREAD_COLOR)
+            rows = pipeline.process_image(name, base_image, document_metrics)
+        csv_string = output.rows_to_csvstring(rows)
+        document_metrics.add_time('total', time.perf_counter() - start)
+        document_metrics.ok = True
+    except get_table_image.TableImageException:
+        csv_string = None
+        document_metrics.ok = False
+    except Exception:
+        print(traceback.format_exc())
+        csv_string = None
+        document_metrics.ok = False
+    document_metrics.record_peak_rss()
+    return csv_string, document_metrics
+
+
+def run_corpus(corpus_directory: str) -> dict:
+    paths = sorted(os.path.join(corpus_directory, file_name) for file_name in os.listdir(corpus_directory)
+                   if file_name.lower().endswith(('.pdf',) + IMAGE_EXTENSIONS))
+    if len(paths) == 0: raise SystemExit(f'No fixture PDFs or images in {corpus_directory}')
+
+    documents = {}
+    all_metrics = []
+    all_truth_pairs = 0; all_detected_pairs = 0
+    start = time.perf_counter()
+    for path in paths:
+        csv_string, document_metrics = run_document(path)
+        all_metrics.append(document_metrics)
+        truth_path = os.path.splitext(path)[0] + '.csv'
+        rate = None
+        if os.path.exists(truth_path):
+            truth = load_ground_truth(truth_path)
+            rate = detection_rate(truth, get_pairs(csv_string or ''))
+            if rate is not None:
+                all_truth_pairs += len(truth)
+                all_detected_pairs += round(rate * len(truth))
+        documents[document_metrics.name] = {
+            'ok': document_metrics.ok,
+            'detection_rate': rate,
+            'seconds': document_metrics.wall_seconds.get('total'),
+            'cells': document_metrics.counts.get('cells', 0),
+        }
+        print(f'{document_metrics.name}: {"OK" if document_metrics.ok else "NOK"}, detection rate {rate if rate is None else round(rate,3)}')
+    wall_seconds = time.perf_counter() - start
+
+    stages = {}
+    for document_metrics in all_metrics:
+        for stage,seconds in document_metrics.wall_seconds.items(): stages.setdefault(stage, []).append(seconds)
+    total_cells = sum(document_metrics.counts.get('cells', 0) for document_metrics in all_metrics)
+    peak_rss = [document_metrics.peak_rss_bytes for document_metrics in all_metrics if document_metrics.peak_rss_bytes is not None]
+
+    return {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'corpus': corpus_directory,
+        'config': {'ocr_mode': config.ocr_mode, 'ocr_workers': config.ocr_workers, 'working_resolution_long_edge': config.working_resolution_long_edge},
+        'documents': len(all_metrics),
+        'ok_documents': sum(1 for document_metrics in all_metrics if document_metrics.ok),
+        'wall_seconds': wall_seconds,
+        'docs_per_second': len(all_metrics) / wall_seconds,
+        'cells_per_second': total_cells / wall_seconds,
+        'tesseract_calls': sum(document_metrics.counts.get('tesseract_calls', 0) for document_metrics in all_metrics),
+        'peak_rss_bytes': max(peak_rss) if peak_rss else None,
+        'detection_rate': all_detected_pairs / all_truth_pairs if all_truth_pairs else None,
+        'stage_seconds': {stage: percentiles(values) for stage,values in stages.items()},
+        'per_document': documents,
+    }
+
+
+def print_results(results: dict):
+    print(f'{results["documents"]} documents ({results["ok_documents"]} OK) in {results["wall_seconds"]:.1f}s')
+    print(f'{results["docs_per_second"]:.3f} docs/s, {results["cells_per_second"]:.1f} cells/s, {results["tesseract_calls"]} tesseract calls')
+    if results['peak_rss_bytes'] is not None: print(f'peak RSS {results["peak_rss_bytes"]/1024**2:.0f} MiB')
+    if results['detection_rate'] is not None: print(f'detection rate {results["detection_rate"]:.3f}')
+    print(f'{"stage":<24}{"p50":>10}{"p90":>10}{"p99":>10}{"max":>10}')
+    for stage,values in results['stage_seconds'].items():
+        print(f'{stage:<24}{values["p50"]:>10.3f}{values["p90"]:>10.3f}{values["p99"]:>10.3f}{values["max"]:>10.3f}')
+
+
+def print_comparison(baseline: dict, results: dict):
+    """Prints the change of each headline number and stage p50/p90 against the baseline."""
+    def change(name: str, old, new, higher_is_better: bool, noise: float = 0.0):
+        if old is None or new is None:
+            print(f'{name:<32}{str(old):>12}{str(new):>12}')
+            return
+        relative = (new - old) / old * 100 if old else 0.0
+        better = (relative > 0) == higher_is_better
+        marker = '' if abs(relative) < 5 or abs(new - old) <= noise else (' better' if better else ' WORSE')
+        print(f'{name:<32}{old:>12.3f}{new:>12.3f}{relative:>+9.1f}%{marker}')
+
+    print(f'COMPARISON against baseline of {baseline["created"]}')
+    print(f'{"":<32}{"baseline":>12}{"now":>12}')
+    change('docs/s', baseline['docs_per_second'], results['docs_per_second'], True)
+    change('cells/s', baseline['cells_per_second'], results['cells_per_second'], True)
+    change('detection rate', baseline['detection_rate'], results['detection_rate'], True)
+    if baseline['peak_rss_bytes'] and results['peak_rss_bytes']:
+        change('peak RSS (MiB)', baseline['peak_rss_bytes']/1024**2, results['peak_rss_bytes']/1024**2, False)
+    for stage,values in results['stage_seconds'].items():
+        if stage not in baseline['stage_seconds']: continue
+        # differences of a few milliseconds are just noise
+        change(f'{stage} p50 (s)', baseline['stage_seconds'][stage]['p50'], values['p50'], False, 0.01)
+        change(f'{stage} p90 (s)', baseline['stage_seconds'][stage]['p90'], values['p90'], False, 0.01)
+    for name,document in results['per_document'].items():
+        old_rate = baseline['per_document'].get(name, {}).get('detection_rate')
+        if old_rate is not None and document['detection_rate'] is not None and document['detection_rate'] < old_rate:
+            print(f'detection rate dropped for {name}: {old_rate:.3f} -> {document["detection_rate"]:.3f}')
+
+
+def make_synthetic_corpus(corpus_directory: str, count: int):
+    from benchmarks import synthetic
+    os.makedirs(corpus_directory, exist_ok=True)
+    for i in range(count):
+        image, truth = synthetic.make_table_scan_with_truth(seed=i, skew=0.02)
+        cv2.imwrite(os.path.join(corpus_directory, f'synthetic_{i:03}.png'), image)
+        with open(os.path.join(corpus_directory, f'synthetic_{i:03}.csv'), 'wt', newline='') as f: csv.writer(f).writerows(truth)
+    print(f'wrote {count} synthetic documents to {corpus_directory}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline speed and accuracy benchmark of the pipeline over a corpus of fixture documents.')
+    parser.add_argument('--corpus', default=os.path.join('benchmarks', 'fixtures'), help='folder of fixture PDFs/images and their ground truth csv files')
+    parser.add_argument('--output', help='write the results to this JSON file (eg: to use as a baseline)')
+    parser.add_argument('--compare', help='baseline JSON file to compare the results against')
+    parser.add_argument('--working-resolution', type=int, metavar='PIXELS', help='override config.working_resolution_long_edge')
+    parser.add_argument('--make-synthetic', type=int, metavar='N', help='write N synthetic documents (table images and ground truth) to the corpus folder and exit')
+    args = parser.parse_args()
+
+    if args.make_synthetic:
+        make_synthetic_corpus(args.corpus, args.make_synthetic)
+        return
+
+    # measure the real work - nothing from the cache, no debug images
+    config.use_cache = False
+    config.debug_level = 'off'
+    if args.working_resolution: config.working_resolution_long_edge = args.working_resolution
+
+    results = run_corpus(args.corpus)
+    print_results(results)
+    if args.compare:
+        with open(args.compare, 'rt') as f: print_comparison(json.load(f), results)
+    if args.output:
+        with open(args.output, 'wt') as f: json.dump(results, f, indent=1)
+        print(f'results written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Micro-benchmark of image_processing_stage_3.try_to_remove_gridlines on a 3000x2000 synthetic table scan,
+against the original implementation that whitened the neighbourhood of each contour point pixel by pixel.
+
+Run from the repository root:
+    python -m benchmarks.gridline_removal
+"""
+import time
+
+import numpy as np
+
+from src import image_processing
+from src import image_processing_stage_3
+from benchmarks import synthetic
+
+
+def original_try_to_remove_gridlines(unwarped_base_image, unwarped_base_image_larger_contours):
+    gridless_image = unwarped_base_image.copy()
+
+    for contour in unwarped_base_image_larger_contours:
+        for point in contour:
+            x = point[0][0]; y = point[0][1]
+            for Y in range(y-3,y+4):
+                for X in range(x-3,x+4):
+                    try: gridless_image[Y,X] = [255,255,255]
+                    except IndexError: continue
+
+    return gridless_image
+
+
+def main():
+    image = synthetic.make_table_scan(3000, 2000)
+    larger_contours,_ = image_processing.get_larger_contours_from_image(image)
+    print(f'{sum(len(contour) for contour in larger_contours)} contour points in {len(larger_contours)} larger contours')
+
+    start = time.perf_counter()
+    expected = original_try_to_remove_gridlines(image, larger_contours)
+    original_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = image_processing_stage_3.try_to_remove_gridlines(image, larger_contours)
+    vectorized_seconds = time.perf_counter() - start
+
+    # the original wrapped around to the opposite edge (negative indexing) for points within 3px of the top/left edge - ignore the 3px border
+    identical = np.array_equal(expected[3:-3,3:-3], result[3:-3,3:-3])
+    print(f'original   : {original_seconds*1000:10.1f} ms')
+    print(f'vectorized : {vectorized_seconds*1000:10.1f} ms  ({original_seconds/vectorized_seconds:.0f}x faster, identical output: {identical})')
+
+
+if __name__ == '__main__':
+    main()
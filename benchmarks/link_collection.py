@@ -0,0 +1,135 @@
+"""Benchmark of webscrape.collect_links against a local fixture of the exchange rates page (no network):
+a page with a table of links like the customs website's, served by a local HTTP server.
+Times the plain HTTP collector, and the browser collector if playwright and its browser are installed, and checks that they get every link.
+Then checks that the 'auto' collector only keeps the links of the HTML when they are the whole table (and cuts the first page to the length the page sets),
+and falls back to the browser for a page with only some of the rows in its HTML, with server-side processing, or without a page length when only the first page is wanted.
+
+Run from the repository root:
+    python -m benchmarks.link_collection --links 500
+    python -m benchmarks.link_collection --serve      # just serve the fixture (eg: to point config.exchange_rates_url at it)
+"""
+import argparse
+import html
+import threading
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from src import webscrape
+
+
+def make_fixture_page(link_count: int, page_length: int = 10, rows_in_html: int = None, server_side: bool = False) -> tuple[str,list[tuple[str,str]]]:
+    """Returns the HTML of the fixture page and the (link name, link href) pairs it should give, newest first like on the website.
+    Half the hrefs are relative to the website, like some of the real ones (the collector makes them absolute with the URL of the page).
+
+    Args:
+        link_count (int): rows of the whole table
+        page_length (int, optional): rows on a page of the table, set with data-page-length. Defaults to 10. None leaves it out.
+        rows_in_html (int, optional): only this many rows are in the HTML, and the DataTables info text says how many there are in all. Defaults to None (all of them).
+        server_side (bool, optional): the table is set up with server-side processing, like a table that fetches its rows a page at a time. Defaults to False.
+    """
+    rows = []
+    expected = []
+    for i in range(link_count):
+        day = date(2024, 12, 30) - timedelta(weeks=i)
+        name = f'Exchange Rates {day:%d.%m.%Y} &amp; notes' if i % 7 == 0 else f'Exchange Rates {day:%d.%m.%Y}'
+        href = f'/wp-content/uploads/{day:%Y/%m}/exchange-rates-{day:%Y-%m-%d}.pdf'
+        if i % 2 == 0: href = 'https://www.customs.gov.lk' + href
+        rows.append(f'<tr><td>{day.isoformat()}</td><td><a href="{html.escape(href)}">{name}</a></td></tr>')
+        expected.append((name, href))
+    if rows_in_html is not None: rows = rows[:rows_in_html]
+    page_length_attribute = f' data-page-length="{page_length}"' if page_length is not None else ''
+    info = f'<div id="{webscrape.TABLE_ID}_info">Showing 1 to {len(rows)} of {link_count:,} entries</div>' if rows_in_html is not None else ''
+    script = f'<script>jQuery("#{webscrape.TABLE_ID}").DataTable({{"serverSide": true, "ajax": "/rows"}});</script>' if server_side else ''
+    page = ('<!DOCTYPE html><html><head><title>Exchange Rates</title></head><body>'
+            '<table><tr><td><a href="/not-a-rate.pdf">not in the table</a></td></tr></table>'
+            f'<table id="{webscrape.TABLE_ID}"{page_length_attribute}><thead><tr><th>Date</th><th>Document</th></tr></thead><tbody>{"".join(rows)}</tbody></table>'
+            f'{info}{script}</body></html>')
+    return page, expected
+
+
+def serve_fixture(page: str, port: int = 0, background: bool = True) -> ThreadingHTTPServer:
+    """Serves the page (at every path) from a background thread. The URL is http://127.0.0.1:{server.server_port}/
+    With background False, the server is only made - the caller serves with server.serve_forever()."""
+    page_bytes = page.encode()
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(page_bytes)))
+            self.end_headers()
+            self.wfile.write(page_bytes)
+        def log_message(self, *args): pass
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    if background: threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--links', type=int, default=500, help='links in the fixture table')
+    parser.add_argument('--serve', action='store_true', help='only serve the fixture page until interrupted')
+    parser.add_argument('--port', type=int, default=0)
+    args = parser.parse_args()
+
+    page, expected = make_fixture_page(args.links)
+    server = serve_fixture(page, args.port, background=not args.serve)
+    url = f'http://127.0.0.1:{server.server_port}/exchange-rates/'
+    if args.serve:
+        print(f'serving the fixture page with {args.links} links at {url}')
+        try: server.serve_forever()
+        except KeyboardInterrupt: pass
+        server.server_close()
+        return
+    expected = [(name, href if href.startswith('http') else f'http://127.0.0.1:{server.server_port}{href}') for name,href in expected]
+
+    for collector in ('http', 'browser'):
+        start = time.perf_counter()
+        try: links = webscrape.collect_links(url=url, collector=collector)
+        except Exception as e:
+            print(f'{collector:<8} failed: {str(e).splitlines()[0] if str(e) else type(e).__name__}')
+            continue
+        seconds = time.perf_counter() - start
+        print(f'{collector:<8} {len(links)} links in {seconds:.3f}s, {"all correct" if links == expected else "WRONG LINKS"}')
+    server.shutdown()
+
+    if not check_auto_collector(args.links): raise SystemExit(1)
+
+
+def check_auto_collector(link_count: int) -> bool:
+    """Checks which links the 'auto' collector keeps from the HTML of fixture pages, and when it falls back to the browser.
+    The browser collector is swapped for one that only records that it was called, so this runs without playwright."""
+    browser_calls = []
+    def record_browser_call(url, check_older_pages=True, known_hrefs=None):
+        browser_calls.append(url)
+        return []
+    collect_links_with_browser = webscrape.collect_links_with_browser
+    webscrape.collect_links_with_browser = record_browser_call
+
+    # (name, fixture page arguments, check_older_pages, number of links expected from the HTML - None for the browser)
+    cases = [('whole table in the HTML', {}, True, link_count),
+             ('first page, length set by the page', {'page_length': 25}, False, 25),
+             ('first page, all rows on it', {'page_length': -1}, False, link_count),
+             ('first page, length not set', {'page_length': None}, False, None),
+             ('only the first page in the HTML', {'rows_in_html': 10}, True, None),
+             ('server-side processing', {'server_side': True}, True, None)]
+    passed = True
+    for name,fixture_arguments,check_older_pages,expected_count in cases:
+        page, expected = make_fixture_page(link_count, **fixture_arguments)
+        server = serve_fixture(page)
+        url = f'http://127.0.0.1:{server.server_port}/exchange-rates/'
+        expected = [(label, href if href.startswith('http') else f'http://127.0.0.1:{server.server_port}{href}') for label,href in expected]
+        browser_calls.clear()
+        links = webscrape.collect_links(check_older_pages, url=url, collector='auto')
+        server.shutdown()
+        if expected_count is None: case_passed = len(browser_calls) == 1
+        else: case_passed = len(browser_calls) == 0 and links == expected[:expected_count]
+        print(f'{"ok  " if case_passed else "FAIL"} auto: {name} - {"browser" if browser_calls else f"{len(links)} links from the HTML"}')
+        passed &= case_passed
+
+    webscrape.collect_links_with_browser = collect_links_with_browser
+    return passed
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Checks that the OCR cache (src/ocr_cache.py) never returns the text of another cell, on synthetic cells (no tesseract needed):
+- a cell read again gets its cached text
+- near-identical words (eg: Krone and Krona, CN and CH) don't get each other's text, whichever of them is cached
+- with every country and currency cached, each one gets its own text back
+and reports how far apart the closest pairs of different words are, for comparison with 2 scans of the same word.
+
+Run from the repository root:
+    python -m benchmarks.ocr_cache
+"""
+import argparse
+import itertools
+import os
+import tempfile
+
+import numpy as np
+import cv2
+
+from benchmarks import synthetic
+from benchmarks.ocr_profiles import CURRENCIES
+from src import ocr_cache
+
+
+NEAR_IDENTICAL_WORDS = [('Krone', 'Krona'), ('CN', 'CH'), ('Dinar', 'Dirham'), ('Rupee', 'Rupiah'), ('Austria', 'Australia')]
+
+
+def rescan(cell, rng: np.random.Generator):
+    """The cell as in another scan: shifted by a few pixels, with noise."""
+    shift = np.float32([[1,0,rng.uniform(-3,3)],[0,1,rng.uniform(-2,2)]])
+    cell = cv2.warpAffine(cell, shift, (cell.shape[1],cell.shape[0]), borderValue=(255,255,255))
+    return np.clip(cell.astype(np.int16) + rng.normal(0, 12, cell.shape), 0, 255).astype(np.uint8)
+
+
+def distance(a, b) -> float:
+    """Ratio of differing bits of 2 fingerprints."""
+    return np.unpackbits(a[0] ^ b[0]).mean()
+
+
+def check(name: str, passed: bool, detail: str = '') -> bool:
+    print(f'{"ok  " if passed else "FAIL"} {name}' + (f' ({detail})' if detail else ''))
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    rng = np.random.default_rng(args.seed)
+
+    passed = True
+    with tempfile.TemporaryDirectory() as directory:
+        for i,(word_a,word_b) in enumerate(NEAR_IDENTICAL_WORDS):
+            cache = ocr_cache.OcrCache(os.path.join(directory, f'near_{i}.sqlite'), 1000)
+            fingerprint_a = ocr_cache.get_fingerprint(synthetic.make_cell(word_a))
+            fingerprint_b = ocr_cache.get_fingerprint(synthetic.make_cell(word_b))
+            cache.put('words', [fingerprint_a], [word_a])
+            passed &= check(f'{word_a} read again is a hit', cache.get('words', [ocr_cache.get_fingerprint(synthetic.make_cell(word_a))]) == [word_a])
+            passed &= check(f'{word_b} is not {word_a}', cache.get('words', [fingerprint_b]) == [None], f'{distance(fingerprint_a, fingerprint_b):.3f} apart')
+            cache.put('words', [fingerprint_b], [word_b])
+            passed &= check(f'{word_a} and {word_b} both cached get their own text', cache.get('words', [fingerprint_a, fingerprint_b]) == [word_a, word_b])
+
+        words = sorted(set(synthetic.COUNTRIES) | set(CURRENCIES))
+        fingerprints = [ocr_cache.get_fingerprint(synthetic.make_cell(word)) for word in words]
+        cache = ocr_cache.OcrCache(os.path.join(directory, 'all.sqlite'), 10000)
+        cache.put('words', fingerprints, words)
+        texts = cache.get('words', fingerprints)
+        wrong = [(word,text) for word,text in zip(words,texts) if text != word]
+        passed &= check(f'{len(words)} countries and currencies each get their own text', len(wrong) == 0, ', '.join(f'{word} got {text}' for word,text in wrong[:5]))
+
+        closest = sorted((distance(fingerprints[i], fingerprints[j]), words[i], words[j]) for i,j in itertools.combinations(range(len(words)), 2)
+                         if abs(np.log(fingerprints[i][1] / fingerprints[j][1])) <= np.log(1.1))
+        rescans = [distance(fingerprint, ocr_cache.get_fingerprint(rescan(synthetic.make_cell(word), rng))) for word,fingerprint in zip(words,fingerprints)]
+        print('closest different words: ' + ', '.join(f'{a}/{b} {d:.3f}' for d,a,b in closest[:3]))
+        print(f'2 scans of the same word: median {np.median(rescans):.3f}, max {max(rescans):.3f} apart')
+    if not passed: raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
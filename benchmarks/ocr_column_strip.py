@@ -0,0 +1,36 @@
+"""Compares accuracy and throughput of per-cell OCR against OCRing whole columns stitched into one strip.
+
+Run from the repository root:
+    python -m benchmarks.ocr_column_strip --rows 60
+"""
+import argparse
+import time
+
+from src import tesseract_interface
+from benchmarks import synthetic
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=60)
+    args = parser.parse_args()
+
+    columns = {'country': synthetic.make_text_cells(args.rows), 'er': synthetic.make_column_cells(args.rows)}
+    tesseract_interface.get_ocr_of_images(columns['er'][0][:1], '7') # warm the pool up
+
+    for column_name,(cells,truth) in columns.items():
+        start = time.perf_counter()
+        per_cell_results = tesseract_interface.get_ocr_of_images(cells, '7')
+        per_cell_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        strip_results = tesseract_interface.get_ocr_of_column_strip(cells)
+        strip_seconds = time.perf_counter() - start
+
+        print(f'{column_name} ({args.rows} rows)')
+        print(f'  per cell     : {args.rows/per_cell_seconds:8.1f} cells/s  accuracy {synthetic.accuracy(per_cell_results,truth):.3f}')
+        print(f'  column strip : {args.rows/strip_seconds:8.1f} cells/s  accuracy {synthetic.accuracy(strip_results,truth):.3f}')
+
+
+if __name__ == '__main__':
+    main()
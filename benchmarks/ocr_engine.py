@@ -0,0 +1,37 @@
+"""Compares cells per second of the old one-process-per-cell OCR against the pool of warm OCR workers.
+
+Run from the repository root:
+    python -m benchmarks.ocr_engine --cells 300
+"""
+import argparse
+import time
+
+from src import tesseract_interface
+from benchmarks import synthetic
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cells', type=int, default=300)
+    args = parser.parse_args()
+
+    cells, truth = synthetic.make_column_cells(args.cells)
+
+    start = time.perf_counter()
+    per_cell_results = [tesseract_interface.get_ocr_of_image(cell, '7') for cell in cells]
+    per_cell_seconds = time.perf_counter() - start
+
+    tesseract_interface.get_ocr_of_images(cells[:1], '7') # warm the pool up, as it would be for all but the first document
+    start = time.perf_counter()
+    pool_results = tesseract_interface.get_ocr_of_images(cells, '7')
+    pool_seconds = time.perf_counter() - start
+
+    engine = 'tesserocr' if tesseract_interface.tesserocr is not None else 'tesseract batch mode'
+    print(f'cells: {args.cells}, OCR workers: {tesseract_interface.get_worker_count()} ({engine})')
+    print(f'per-cell Popen : {args.cells/per_cell_seconds:8.1f} cells/s  accuracy {synthetic.accuracy(per_cell_results,truth):.3f}')
+    print(f'worker pool    : {args.cells/pool_seconds:8.1f} cells/s  accuracy {synthetic.accuracy(pool_results,truth):.3f}')
+    print(f'speed-up       : {per_cell_seconds/pool_seconds:8.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Compares cells per second and accuracy of each column OCR'd with the default tesseract settings against its OCR profile (output.OCR_PROFILES).
+
+Run from the repository root:
+    python -m benchmarks.ocr_profiles --cells 200
+"""
+import argparse
+import random
+import time
+
+from src import output
+from src import tesseract_interface
+from benchmarks import synthetic
+
+
+CURRENCIES = ['Australian Dollar','Bahraini Dinar','Canadian Dollar','Yuan Renminbi','Danish Krone','Euro','Hong Kong Dollar','Indian Rupee',
+              'Japanese Yen','Kuwaiti Dinar','Malaysian Ringgit','New Zealand Dollar','Norwegian Krone','Omani Rial','Qatari Riyal','Saudi Riyal',
+              'Singapore Dollar','Swedish Krona','Swiss Franc','Thai Baht','UAE Dirham','Pound Sterling','US Dollar']
+COUNTRY_CODES = ['AU','BH','CA','CN','DK','EU','HK','IN','JP','KW','MY','NZ','NO','OM','QA','SA','SG','SE','CH','TH','AE','GB','US']
+CURRENCY_CODES = ['AUD','BHD','CAD','CNY','DKK','EUR','HKD','INR','JPY','KWD','MYR','NZD','NOK','OMR','QAR','SAR','SGD','SEK','CHF','THB','AED','GBP','USD']
+
+
+def make_column(column: str, count: int, seed: int = 0) -> tuple[list,list[str]]:
+    """Returns (cells, ground truth texts) of one column of the table."""
+    rng = random.Random(seed)
+    if column == 'er': return synthetic.make_column_cells(count, seed)
+    choices = {'country': synthetic.COUNTRIES, 'country_code': COUNTRY_CODES, 'currency': CURRENCIES, 'currency_code': CURRENCY_CODES}[column]
+    texts = [rng.choice(choices) for _ in range(count)]
+    return [synthetic.make_cell(text) for text in texts], texts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cells', type=int, default=200, help='cells per column')
+    args = parser.parse_args()
+
+    engine = 'tesserocr' if tesseract_interface.tesserocr is not None else 'tesseract batch mode'
+    print(f'cells per column: {args.cells}, OCR workers: {tesseract_interface.get_worker_count()} ({engine})')
+    print(f'{"column":<16}{"default cells/s":>16}{"accuracy":>10}{"profile cells/s":>18}{"accuracy":>10}')
+    for column,variables in output.OCR_PROFILES.items():
+        cells, truth = make_column(column, args.cells)
+        # warm the workers up with both settings
+        tesseract_interface.get_ocr_of_images(cells[:1], '7')
+        tesseract_interface.get_ocr_of_images(cells[:1], '7', variables)
+
+        start = time.perf_counter()
+        default_results = tesseract_interface.get_ocr_of_images(cells, '7')
+        default_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        profile_results = tesseract_interface.get_ocr_of_images(cells, '7', variables)
+        profile_seconds = time.perf_counter() - start
+
+        print(f'{column:<16}{args.cells/default_seconds:>16.1f}{synthetic.accuracy(default_results,truth):>10.3f}'
+              f'{args.cells/profile_seconds:>18.1f}{synthetic.accuracy(profile_results,truth):>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Checks and times webscrape.prefetch_pdfs against a local HTTP server serving fixture PDFs (no network):
+- the PDFs are yielded in the order of the links, with the bytes that were served
+- no more than prefetch_queue_size PDFs are downloaded ahead of the caller, while the caller is busy processing
+- a 404 fails at once (no retries), a 503 is retried until the PDF comes through, and a response slower than download_timeout fails
+and reports how long the caller waited for downloads on top of its processing (mostly the retries of the slow response, as the others overlap the processing).
+
+Run from the repository root:
+    python -m benchmarks.prefetch --documents 12 --processing-seconds 0.2
+"""
+import argparse
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+from src import webscrape
+
+
+def make_fixture_pdfs(count: int, size: int = 200_000) -> dict[str,bytes]:
+    """Fixture PDFs by path. Only the header is a real PDF - the downloader doesn't care what is in them."""
+    return {f'/doc_{i:03}.pdf': b'%PDF-1.4\n' + bytes([i % 256]) * size for i in range(count)}
+
+
+class FixtureServer:
+    """Serves the fixture PDFs from a background thread, plus:
+    /missing.pdf - 404, /slow.pdf - answers after slow_seconds, /flaky.pdf - 503 for the first flaky_failures requests, then a PDF.
+    Every request is recorded (path and time), and so is the largest number of requests in flight at once.
+    The URL of a path is f'http://127.0.0.1:{server.port}{path}'"""
+    def __init__(self, pdfs: dict[str,bytes], download_seconds: float = 0.05, slow_seconds: float = 3, flaky_failures: int = 2) -> None:
+        self.pdfs = pdfs
+        self.requests = [] # (path, time)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+        fixture = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with fixture._lock:
+                    fixture.requests.append((self.path, time.perf_counter()))
+                    fixture.in_flight += 1
+                    fixture.max_in_flight = max(fixture.max_in_flight, fixture.in_flight)
+                    flaky_requests = sum(1 for path,_ in fixture.requests if path == '/flaky.pdf')
+                try:
+                    if self.path == '/slow.pdf': time.sleep(slow_seconds)
+                    else: time.sleep(download_seconds) # like a real server, a download takes a while
+                    if self.path == '/flaky.pdf' and flaky_requests <= flaky_failures: return self.send_error(503)
+                    body = fixture.pdfs[min(fixture.pdfs)] if self.path in ('/slow.pdf','/flaky.pdf') else fixture.pdfs.get(self.path)
+                    if body is None: return self.send_error(404)
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/pdf')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                except (BrokenPipeError, ConnectionResetError): pass # the client timed out and went away
+                finally:
+                    with fixture._lock: fixture.in_flight -= 1
+            def log_message(self, *args): pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_port
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, path: str) -> str:
+        return f'http://127.0.0.1:{self.port}{path}'
+
+    def request_count(self, path: str) -> int:
+        with self._lock: return sum(1 for request_path,_ in self.requests if request_path == path)
+
+    def started_paths(self) -> set[str]:
+        with self._lock: return {path for path,_ in self.requests}
+
+    def shutdown(self):
+        self.server.shutdown()
+
+
+def check(name: str, passed: bool, detail: str = '') -> bool:
+    print(f'{"ok  " if passed else "FAIL"} {name}' + (f' ({detail})' if detail else ''))
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--documents', type=int, default=12, help='fixture PDFs to serve')
+    parser.add_argument('--processing-seconds', type=float, default=0.2, help='time the caller spends on each PDF, like the processing of a document')
+    parser.add_argument('--queue-size', type=int, default=config.prefetch_queue_size)
+    args = parser.parse_args()
+
+    # before the shared session is made, as its retries are set up from config
+    config.download_timeout = 1
+    config.download_retries = 3
+    pdfs = make_fixture_pdfs(args.documents)
+    fixture = FixtureServer(pdfs)
+    paths = list(pdfs)
+    # the failing ones go in the middle, so the documents around them show they don't hold up the rest
+    paths[len(paths)//2:len(paths)//2] = ['/missing.pdf', '/slow.pdf', '/flaky.pdf']
+    links = [(path.strip('/'), fixture.url(path)) for path in paths]
+
+    results = {}
+    order = []
+    most_ahead = 0
+    start = time.perf_counter()
+    for i,(name,pdf_link,pdf_bytesio,error,seconds) in enumerate(webscrape.prefetch_pdfs(links, args.queue_size)):
+        # PDFs started but not yet taken by the caller (this one included)
+        most_ahead = max(most_ahead, len(fixture.started_paths()) - i)
+        order.append(name)
+        results[name] = (pdf_bytesio, error, seconds)
+        time.sleep(args.processing_seconds)
+    wall_seconds = time.perf_counter() - start
+    fixture.shutdown()
+
+    passed = True
+    passed &= check('yielded in the order of the links', order == [name for name,_ in links])
+    passed &= check('PDFs are the bytes served', all(results[path.strip('/')][0] is not None and results[path.strip('/')][0].getvalue() == pdf for path,pdf in pdfs.items()))
+    passed &= check(f'at most {args.queue_size} PDFs downloaded ahead of the caller', most_ahead <= args.queue_size, f'most ahead: {most_ahead}')
+    missing_bytesio,missing_error,_ = results['missing.pdf']
+    passed &= check('404 fails without retries', missing_bytesio is None and '404' in missing_error and fixture.request_count('/missing.pdf') == 1,
+                    f'{fixture.request_count("/missing.pdf")} requests')
+    flaky_bytesio,flaky_error,_ = results['flaky.pdf']
+    passed &= check('503 is retried until the PDF comes through', flaky_bytesio is not None and not flaky_error and fixture.request_count('/flaky.pdf') == 3,
+                    f'{fixture.request_count("/flaky.pdf")} requests')
+    slow_bytesio,slow_error,slow_seconds = results['slow.pdf']
+    passed &= check(f'a response slower than the {config.download_timeout}s timeout fails', slow_bytesio is None and 'timed out' in slow_error.lower(),
+                    f'{fixture.request_count("/slow.pdf")} requests, gave up after {slow_seconds:.1f}s')
+
+    processing_seconds = args.processing_seconds * len(links)
+    download_seconds = sum(seconds for _,_,seconds in results.values())
+    print(f'{len(links)} documents in {wall_seconds:.2f}s: {processing_seconds:.2f}s of processing, {download_seconds:.2f}s of downloads '
+          f'(at most {fixture.max_in_flight} at once), {wall_seconds - processing_seconds:.2f}s waiting for downloads')
+    if not passed: raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
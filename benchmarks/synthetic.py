@@ -0,0 +1,73 @@
+"""Synthetic table cells for benchmarking the OCR side of the pipeline without needing any scanned PDFs."""
+import random
+
+import numpy as np
+import cv2
+from cv2.typing import MatLike
+
+
+COUNTRIES = ['Australia','Bahrain','Canada','China','Denmark','Euro Zone','Hong Kong','India','Japan','Kuwait',
+             'Malaysia','New Zealand','Norway','Oman','Qatar','Saudi Arabia','Singapore','Sweden','Switzerland',
+             'Thailand','United Arab Emirates','United Kingdom','United States']
+
+
+def make_cell(text: str, width: int = 420, height: int = 60) -> MatLike:
+    """Renders the text in black onto a white cell (3 channel, like the cells cropped from the scans)."""
+    cell = np.full((height,width,3), 255, np.uint8)
+    cv2.putText(cell, text, (10,height-18), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0,0,0), 2, cv2.LINE_AA)
+    return cell
+
+
+def make_column_cells(count: int, seed: int = 0) -> tuple[list[MatLike],list[str]]:
+    """Returns (cells, ground truth texts) for a column of exchange rates."""
+    rng = random.Random(seed)
+    texts = [f'{rng.uniform(1,900):.4f}' for _ in range(count)]
+    return [make_cell(text, 240) for text in texts], texts
+
+
+def make_text_cells(count: int, seed: int = 0) -> tuple[list[MatLike],list[str]]:
+    """Returns (cells, ground truth texts) for a column of country names."""
+    rng = random.Random(seed)
+    texts = [rng.choice(COUNTRIES) for _ in range(count)]
+    return [make_cell(text) for text in texts], texts
+
+
+def accuracy(results: list[str], truth: list[str]) -> float:
+    """Ratio of results that exactly match the ground truth after stripping whitespace."""
+    if len(truth) == 0: return 0.0
+    return sum(1 for r,t in zip(results,truth) if r.strip() == t) / len(truth)
+
+
+def make_table_scan(width: int = 3000, height: int = 2000, rows: int = 40, seed: int = 0) -> MatLike:
+    """Renders a table like the exchange rate sheets (6 columns, ruled gridlines, some text in each cell) on a white page."""
+    return make_table_scan_with_truth(width, height, rows, seed)[0]
+
+
+def make_table_scan_with_truth(width: int = 3000, height: int = 2000, rows: int = 40, seed: int = 0, skew: float = 0.0) -> tuple[MatLike,list[list[str]]]:
+    """Renders a table like the exchange rate sheets (6 columns, ruled gridlines, some text in each cell) on a white page.
+    skew (ratio of the image size) moves the table corners around randomly, like a sheet that was scanned at an angle.
+
+    Returns:
+        tuple[MatLike,list[list[str]]]: the image, and the ground truth rows (country, country code, currency, currency code, exchange rate) - the same columns as the output csv files
+    """
+    rng = random.Random(seed)
+    image = np.full((height,width,3), 255, np.uint8)
+    margin = 60
+    column_edges = [margin + round(ratio*(width-2*margin)) for ratio in (0, 0.06, 0.36, 0.46, 0.76, 0.86, 1)]
+    row_edges = [margin + round(i*(height-2*margin)/rows) for i in range(rows+1)]
+    for x in column_edges: cv2.line(image, (x,row_edges[0]), (x,row_edges[-1]), (0,0,0), 3)
+    for y in row_edges: cv2.line(image, (column_edges[0],y), (column_edges[-1],y), (0,0,0), 3)
+    truth = []
+    for i,(top,bottom) in enumerate(zip(row_edges, row_edges[1:])):
+        country = rng.choice(COUNTRIES)
+        row = [country, country[:2].upper(), 'Currency', country[:3].upper(), f'{rng.uniform(1,900):.4f}']
+        truth.append(row)
+        for left,text in zip(column_edges, [str(i+1)] + row):
+            cv2.putText(image, text, (left+10,bottom-12), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0,0,0), 2, cv2.LINE_AA)
+
+    if skew > 0:
+        corners = np.float32([[0,0],[width,0],[0,height],[width,height]])
+        moved_corners = corners + np.float32([[rng.uniform(-1,1)*skew*width, rng.uniform(-1,1)*skew*height] for _ in range(4)])
+        M = cv2.getPerspectiveTransform(corners, moved_corners)
+        image = cv2.warpPerspective(image, M, (width,height), borderValue=(255,255,255))
+    return image, truth
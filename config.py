@@ -1 +1,86 @@
+import os
+
 check_older_pages_when_webscraping = True
+
+# the page with the table of links to the exchange rate PDFs, and how its links are collected:
+# 'http' - parse them out of the page's HTML (one request, no browser), 'browser' - render the page in headless Chromium (playwright),
+# 'auto' - 'http', falling back to the browser if the HTML isn't the whole table (no links, server-side processing or fewer rows than the table's total),
+# or if only the first page is wanted and the page doesn't set how many rows that is
+exchange_rates_url = 'https://www.customs.gov.lk/exchange-rates/'
+link_collector = 'auto'
+
+# number of warm OCR workers kept alive for the whole run. None means one per CPU.
+ocr_workers = None
+
+# 'cell' - OCR every cell on its own (psm 7).
+# 'column' - stitch the cells of each column into one strip and OCR it with a single call (psm 6), falling back to per-cell OCR for rows that can't be mapped back.
+ocr_mode = 'cell'
+
+# downloading the PDFs
+download_timeout = 60 # seconds
+download_retries = 3
+download_workers = 4 # number of PDFs downloaded at the same time
+prefetch_queue_size = 4 # maximum number of PDFs downloaded ahead of the processing
+
+# cache of downloaded PDFs and the table images extracted from them (--no-cache turns it off, --refresh revalidates the PDFs with the server)
+use_cache = True
+refresh_cache = False
+cache_directory = 'cache'
+cache_max_bytes = 2 * 1024**3
+
+# incremental runs (--incremental) skip documents already processed with this pipeline version. Bump it when a change should reprocess everything.
+pipeline_version = 1
+manifest_path = os.path.join('output', 'manifest.json')
+
+# debug images written to images_for_debugging_and_analysis (--debug-level):
+# 'off' - none (the images aren't even drawn), 'summary' - base image, table corners, final grid and gridless image, 'full' - every stage and every cell
+debug_level = 'off'
+debug_png_compression = 1 # 0 (fastest, biggest files) to 9. OpenCV's default is 3.
+debug_queue_size = 64 # maximum number of debug images waiting for the background writer
+
+# metrics of each document (stage wall/CPU times, counts, peak RSS) are appended to this JSON lines file
+metrics_path = os.path.join('metrics', 'metrics.jsonl')
+
+# contours, table corners and gridline peaks are found on a copy of the image scaled down so that its longer edge is this many pixels,
+# and scaled back up - the unwarping and the cell crops still use the full resolution image. None finds them at full resolution.
+working_resolution_long_edge = None
+
+# stage 2 reuses the larger contours found in stage 1 (moved into the unwarped image with the perspective transform) instead of finding them again.
+# They are still found again if the unwarping scales the table unevenly (strong perspective): if an edge is scaled by more than this factor times another edge,
+# as the moved contours get too far from what is in the image. Evenly scaling a table that is smaller than the image doesn't count.
+reuse_stage_1_contours = False
+max_warp_distortion_for_contour_reuse = 1.25
+
+# before OCR, trim each cell to the bounding box of its ink (plus a white margin) and binarize it to a single channel.
+# Tesseract gets smaller images, but check the detection rate (benchmarks/corpus.py) before turning it on.
+trim_cells_for_ocr = False
+
+# cells without ink (no dark blob bigger than a speck of noise) are recorded as empty without being OCR'd. Counted as blank_cells_skipped in the metrics.
+skip_blank_cells = True
+
+# OCR results of the cells of these columns are cached (in cache_directory/ocr.sqlite) by a fingerprint of the cell image, and only reused for
+# identical fingerprints - cells with different text (eg: Krone and Krona, CN and CH) can be closer than 2 scans of the same text, so near matches
+# can't be trusted. Hits are mostly cells of a scan read again (eg: after a change to the pipeline). Exchange rates ('er') are new every week, so they are always OCR'd.
+use_ocr_cache = True
+ocr_cache_columns = ('country', 'currency')
+ocr_cache_max_entries = 100000
+
+# OCR each column with its own tesseract settings (output.OCR_PROFILES): only the characters a column can have (digits and '.' for the
+# exchange rates, capital letters for the codes), no dictionary for those, and the known country and currency words (ocr_words) for the others.
+use_ocr_profiles = False
+
+# every processed document's rates are also written to this SQLite database (see rates_store), queryable by date and currency. None turns it off.
+rates_store_path = os.path.join('output', 'rates.sqlite')
+
+# daemon mode (python main.py --daemon): a long running process that keeps the pipeline loaded and the OCR workers warm, so that a new document only costs its processing.
+# It processes the PDFs put in daemon_inbox_directory (then moved to its done or failed folder), and every daemon_poll_seconds the documents on the website
+# that aren't up to date in the manifest (None - only the inbox). PDFs are picked up once their size stops changing between 2 scans of the inbox.
+daemon_inbox_directory = 'inbox'
+daemon_inbox_scan_seconds = 2
+daemon_poll_seconds = None
+
+# PDFs whose target page has a text layer with the table in it (eg: made from a spreadsheet rather than scanned) have their table read straight
+# from the text (see pdf_text_table) - no image processing and no OCR. Target pages without any image on them are rendered at vector_page_render_dpi
+# and processed like a scanned table image.
+use_pdf_text_layer = True
+vector_page_render_dpi = 300
@@ -1,75 +1,254 @@
+import argparse
+import cProfile
+import hashlib
+import multiprocessing
 import os
-import subprocess
+import time
 import traceback
+import types
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from datetime import datetime
+from io import BytesIO
 
 from src import webscrape
 from src import get_table_image
-from src import image_processing
-from src import image_processing_stage_1
-from src import image_processing_stage_2
-from src import image_processing_stage_3
 from src import output
+from src import pipeline
 from src import create_dir_structure
+from src import metrics
+from src import debug_writer
+from src import cache
+from src import rates_store
+from src import tesseract_interface
+from src import image_processing_stage_2
+from src.manifest import Manifest
 import config
 
 
-def process_link(name,pdf_link):
-        
-    # download the pdf
-    pdf_bytesio = webscrape.download_pdf_as_bytesio(pdf_link)
+def process_link(name,pdf_bytesio: BytesIO,document_metrics: metrics.DocumentMetrics):
+    """Runs the whole pipeline for one (already downloaded) document, writes its csv to the output folder and its rates to the rates store.
+    The time taken by each stage and some counts are recorded in document_metrics.
+    Raises get_table_image.TableImageException if the table image can't be extracted from the PDF."""
+    rows = pipeline.process_pdf(name,pdf_bytesio,document_metrics)
+
+    with document_metrics.stage('write_output'):
+        output.write_csv(name,rows)
+        store = rates_store.get_rates_store()
+        if store is not None: store.write_document(name,rows)
 
-    # get the table image from PDF
-    try: image_bytes,_  = get_table_image.get_table_image_from_pdfbytesio(pdf_bytesio)
+def run_link(name,pdf_bytes: bytes,flush_debug_images: bool = False) -> tuple[bool,str,metrics.DocumentMetrics]:
+    """Runs process_link, capturing any error so one bad document doesn't stop the others.
+    Takes the PDF as bytes so it can be sent to a worker process.
+    With flush_debug_images, waits for the document's debug images to be written before returning
+    (needed in worker processes, which can exit without their background threads finishing).
+
+    Returns:
+        tuple[bool,str,metrics.DocumentMetrics]: whether it was OK, the error message (empty if OK), metrics of the document
+    """
+    document_metrics = metrics.DocumentMetrics(name)
+    try:
+        process_link(name,BytesIO(pdf_bytes),document_metrics)
+        document_metrics.ok = True
+        return True,'',document_metrics
     except get_table_image.TableImageException:
-        print('Table image exception')
-        print(f'\033[31m{name} NOK!\033[0m')
-        return
-    
-    # convert image to OpenCV matlike. This is our base image.
-    base_image = image_processing.convert_bytes_to_openCV_matlike(image_bytes)
-    output.persist_debugging_images_part0(name,base_image)
+        document_metrics.ok = False
+        return False,'Table image exception',document_metrics
+    except Exception:
+        document_metrics.ok = False
+        return False,traceback.format_exc(),document_metrics
+    finally:
+        if flush_debug_images:
+            with document_metrics.stage('debug_images_flush'): debug_writer.flush_debug_writer()
+        document_metrics.record_peak_rss()
+
+def report(name,ok: bool,message: str):
+    print(name)
+    if message: print(message)
+    if ok: print(f'\033[32m{name} OK!\033[0m')
+    else: print(f'\033[31m{name} NOK!\033[0m')
+
+def init_worker_process(config_overrides: dict):
+    for key,value in config_overrides.items(): setattr(config, key, value)
+
+def download_failed(name,error: str) -> tuple[bool,str,metrics.DocumentMetrics]:
+    """Result (like run_link's) of a document whose PDF couldn't be downloaded."""
+    document_metrics = metrics.DocumentMetrics(name)
+    document_metrics.ok = False
+    return False,error,document_metrics
+
+def process_links(links: list[tuple[str,str]], workers: int, manifest: Manifest = None) -> list[metrics.DocumentMetrics]:
+    """Downloads (in background threads) and processes the documents, reporting each one in the order of the links.
+    With more than 1 worker, documents are processed in parallel in a process pool.
+    If a manifest is given (incremental run), documents that are up to date in it are skipped, and processed documents are recorded in it.
+
+    Returns:
+        list[metrics.DocumentMetrics]: metrics of each processed document
+    """
+    all_metrics = []
+    skipped = 0
 
-    # perform 1st stage of processing, mainly to get the image of just the table - cropped and perspective transformed to compensate for scanner/photograph angle
-    unwarped_base_image,image_with_all_contours,image_with_larger_contours,larger_contours_mask_image,retr_external_img,table_corners = image_processing_stage_1.process_stage_1(base_image)
-    output.persist_debugging_images_part1(name,unwarped_base_image,image_with_all_contours,image_with_larger_contours,larger_contours_mask_image,retr_external_img,table_corners)
+    if manifest is not None and not config.refresh_cache:
+        # documents never change once published, so there's no need to even download the ones already processed
+        new_links = [(name,pdf_link) for name,pdf_link in links if not manifest.is_up_to_date(pdf_link)]
+        skipped += len(links) - len(new_links)
+        links = new_links
+    downloads = webscrape.prefetch_pdfs(links, cache=cache.get_cache(), refresh=config.refresh_cache)
 
-    # 2nd stage of processing - identifying the row and column gridlines from the unwarped base image
-    vertical_lines,horizontal_lines,plot_for_columns,plot_for_rows,unwarped_base_image_with_larger_contours,unwarped_base_image_with_all_contours,larger_contours_of_unwarped_base_image = image_processing_stage_2.process_stage_2(unwarped_base_image)
-    output.persist_debugging_images_part2(name,unwarped_base_image,vertical_lines,horizontal_lines,plot_for_columns,plot_for_rows,unwarped_base_image_with_larger_contours,unwarped_base_image_with_all_contours)
+    def documents():
+        """Downloaded documents that need processing - (name, pdf_link, pdf bytes, content hash, download error, download seconds)"""
+        nonlocal skipped
+        for name,pdf_link,pdf_bytesio,error,download_seconds in downloads:
+            if error:
+                yield name,pdf_link,None,None,error,download_seconds
+                continue
+            pdf_bytes = pdf_bytesio.getvalue()
+            content_hash = hashlib.sha256(pdf_bytes).hexdigest()
+            if manifest is not None and manifest.is_up_to_date(pdf_link,content_hash):
+                skipped += 1
+                continue
+            yield name,pdf_link,pdf_bytes,content_hash,'',download_seconds
 
-    # 3rd stage - extract and get a list of individual cell images
-    cell_images, gridless_image = image_processing_stage_3.process_stage_3(horizontal_lines,vertical_lines,unwarped_base_image,larger_contours_of_unwarped_base_image)
-    output.persist_debugging_images_part3(name,cell_images,gridless_image)
+    def finish(name,pdf_link,content_hash,result: tuple[bool,str,metrics.DocumentMetrics],download_seconds: float):
+        ok,message,document_metrics = result
+        report(name,ok,message)
+        document_metrics.add_time('download',download_seconds)
+        all_metrics.append(document_metrics)
+        if ok and manifest is not None: manifest.record(name,pdf_link,content_hash,output.get_csv_path(name))
 
-    csv_string = output.cell_images_to_csvstring(cell_images)
-    
-    os.makedirs('output', exist_ok=True)
-    with open(f'output/{name}.csv', 'wt') as f:
-        f.write(csv_string)
+    if workers <= 1:
+        for name,pdf_link,pdf_bytes,content_hash,error,download_seconds in documents():
+            result = download_failed(name,error) if error else run_link(name,pdf_bytes)
+            finish(name,pdf_link,content_hash,result,download_seconds)
+    else:
+        # command line options are applied to config, which worker processes don't inherit when they are spawned (rather than forked)
+        config_overrides = {key: value for key,value in vars(config).items() if not key.startswith('_') and not isinstance(value, types.ModuleType)}
+        # each document process gets its share of the CPUs for OCR, instead of every process starting one OCR worker per CPU
+        config_overrides['ocr_workers'] = config.ocr_workers or max(1, (os.cpu_count() or 1) // workers)
+        # the workers are spawned rather than forked: a fork would copy the threads' state mid-use - eg: the cache's SQLite connection and locks,
+        # which the download threads are using, and a lock held at that moment would never be released in the worker
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=init_worker_process, initargs=(config_overrides,)) as executor:
+            # documents are finished in the order of the links, whatever order they are done in.
+            # only a few are submitted ahead of the workers, so that downloaded PDFs don't pile up in memory
+            pending = deque()
+            for name,pdf_link,pdf_bytes,content_hash,error,download_seconds in documents():
+                if error:
+                    future = Future()
+                    future.set_result(download_failed(name,error))
+                else: future = executor.submit(run_link,name,pdf_bytes,True)
+                pending.append((name,pdf_link,content_hash,future,download_seconds))
+                while len(pending) > workers*2:
+                    name,pdf_link,content_hash,future,download_seconds = pending.popleft()
+                    finish(name,pdf_link,content_hash,future.result(),download_seconds)
+            for name,pdf_link,content_hash,future,download_seconds in pending:
+                finish(name,pdf_link,content_hash,future.result(),download_seconds)
 
-    print(f'\033[32m{name} OK!\033[0m')
+    if skipped: print(f'{skipped} documents already up to date, skipped')
+    return all_metrics
 
-def main():
+def process_inbox_file(path: str) -> metrics.DocumentMetrics:
+    """Processes a PDF from the daemon's inbox (the file name is the document name), then moves it to the done or failed folder of the inbox.
+    The error of a failed document is written next to it in a .txt file."""
+    file_name = os.path.basename(path)
+    name = os.path.splitext(file_name)[0]
+    with open(path,'rb') as f: pdf_bytes = f.read()
+    ok,message,document_metrics = run_link(name,pdf_bytes)
+    report(name,ok,message)
+
+    destination = os.path.join(config.daemon_inbox_directory, 'done' if ok else 'failed')
+    os.makedirs(destination, exist_ok=True)
+    os.replace(path, os.path.join(destination, file_name))
+    if not ok:
+        with open(os.path.join(destination, name + '.txt'), 'wt') as f: f.write(message)
+    return document_metrics
+
+def run_daemon():
+    """Daemon mode: processes the PDFs put in the inbox folder (and new documents on the website, if config.daemon_poll_seconds is set)
+    until interrupted, one document at a time in this process - which keeps the pipeline modules loaded and the OCR workers warm between documents.
+    The metrics of every document are appended to the metrics file as soon as it is done."""
+    inbox = config.daemon_inbox_directory
+    os.makedirs(inbox, exist_ok=True)
+    image_processing_stage_2.warm_up()
+    tesseract_interface.start_workers([None] + (list(output.OCR_PROFILES.values()) if config.use_ocr_profiles else []))
+    manifest = Manifest(config.manifest_path) if config.daemon_poll_seconds is not None else None
+    print(f'DAEMON READY {datetime.now()} - watching {os.path.abspath(inbox)}' + (f', checking the website every {config.daemon_poll_seconds}s' if manifest is not None else ''))
+
+    sizes = {} # size of each PDF in the inbox at the previous scan. PDFs that are still being written to are left until it stops changing
+    next_poll = time.monotonic()
+    try:
+        while True:
+            if manifest is not None and time.monotonic() >= next_poll:
+                next_poll = time.monotonic() + config.daemon_poll_seconds
+                try:
+                    links = webscrape.collect_links(config.check_older_pages_when_webscraping, manifest.up_to_date_hrefs())
+                    all_metrics = process_links(links, 1, manifest)
+                    if all_metrics: metrics.write_jsonl(all_metrics, config.metrics_path)
+                except Exception: print(traceback.format_exc()) # eg: the website is down - try again at the next poll
+
+            current_sizes = {}
+            for file_name in sorted(os.listdir(inbox)):
+                path = os.path.join(inbox, file_name)
+                if file_name.lower().endswith('.pdf') and os.path.isfile(path): current_sizes[path] = os.path.getsize(path)
+            ready = [path for path,size in current_sizes.items() if size > 0 and sizes.get(path) == size]
+            sizes = current_sizes
+
+            for path in ready:
+                metrics.write_jsonl([process_inbox_file(path)], config.metrics_path)
+                del sizes[path]
+            if not ready: time.sleep(config.daemon_inbox_scan_seconds)
+    except KeyboardInterrupt:
+        debug_writer.flush_debug_writer()
+        print(f'DAEMON END {datetime.now()}')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Scrapes the customs exchange rate PDFs and extracts the tables to csv files in the output folder.')
+    parser.add_argument('--workers', type=int, default=1, help='number of documents to process in parallel (one process each). Defaults to 1.')
+    parser.add_argument('--no-cache', action='store_true', help="don't read or write the cache of downloaded PDFs and table images")
+    parser.add_argument('--debug-level', choices=['off','summary','full'], help='debug images to write to images_for_debugging_and_analysis. Defaults to config.debug_level.')
+    parser.add_argument('--incremental', action='store_true', help='only process new or changed documents, or ones processed with an older pipeline version')
+    parser.add_argument('--refresh', action='store_true', help='revalidate cached PDFs with the server, downloading them again if they changed')
+    parser.add_argument('--prometheus', metavar='PATH', help='also write the totals of the run to this file in the Prometheus text format')
+    parser.add_argument('--install-browsers', action='store_true', help='install the browser used to collect the links (playwright chromium) before starting')
+    parser.add_argument('--link-collector', choices=['http','browser','auto'], help='how to collect the links of the exchange rates page. Defaults to config.link_collector.')
+    parser.add_argument('--daemon', action='store_true', help='keep running, processing the PDFs put in the inbox folder (and new documents on the website if config.daemon_poll_seconds is set) in a warm process')
+    parser.add_argument('--profile', metavar='PATH', help='run under cProfile and dump the stats to this file (only the main process is profiled)')
+    return parser.parse_args()
+
+def main(args: argparse.Namespace):
+    if args.no_cache: config.use_cache = False
+    if args.refresh: config.refresh_cache = True
+    if args.debug_level is not None: config.debug_level = args.debug_level
+    if args.link_collector is not None: config.link_collector = args.link_collector
     print(f'MAIN START {datetime.now()}')
-    # make sure the playwright browser is installed
-    subprocess.run(['playwright','install','chromium'])
-    subprocess.run(['playwright','install-deps']) # precaution - if runtime environment is something like a lightweight OS we might get the error "host system is missing dependencies to run browsers"
+    # the playwright browser is otherwise only installed if launching it fails
+    if args.install_browsers: webscrape.install_browser()
 
     create_dir_structure.create_output_directories()
+    if args.daemon:
+        run_daemon()
+        return
+
+    manifest = Manifest(config.manifest_path) if args.incremental else None
 
     # collect all links
     check_older_pages_when_webscraping = config.check_older_pages_when_webscraping
-    links = webscrape.collect_links(check_older_pages_when_webscraping); links = links[0:]
+    known_hrefs = manifest.up_to_date_hrefs() if manifest is not None else None
+    links = webscrape.collect_links(check_older_pages_when_webscraping, known_hrefs); links = links[0:]
 
     # for each link
-    for name,pdf_link in links:
-        print(name)
-        try: process_link(name,pdf_link)   
-        except:
-            print(traceback.format_exc())
-            print(f'\033[31m{name} NOK!\033[0m')
+    start = time.perf_counter()
+    all_metrics = process_links(links, args.workers, manifest)
+    debug_writer.flush_debug_writer()
+    wall_seconds = time.perf_counter() - start
 
+    metrics.print_timing_summary(all_metrics, wall_seconds)
+    metrics.write_jsonl(all_metrics, config.metrics_path)
+    if args.prometheus: metrics.write_prometheus_textfile(all_metrics, args.prometheus, wall_seconds)
     print(f'MAIN END {datetime.now()}')
 
-main()
\ No newline at end of file
+if __name__ == '__main__':
+    args = parse_args()
+    if args.profile:
+        cProfile.runctx('main(args)', globals(), locals(), args.profile)
+        print(f'profile written to {args.profile} (view with: python -m pstats {args.profile})')
+    else: main(args)
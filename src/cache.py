@@ -0,0 +1,91 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import config
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class Cache:
+    """Content-addressed on-disk cache with size-bounded LRU eviction.
+    Values are stored as files named by the sha256 of their content (so identical content is only stored once).
+    An SQLite index maps each key to the content hash, some metadata (eg: ETag) and the time it was last used.
+    Safe to use from several threads and processes at once.
+
+    Args:
+        directory (str): folder to keep the cache in
+        max_bytes (int): once the stored content is larger than this, least recently used entries are evicted
+    """
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.join(directory, 'blobs'), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(os.path.join(directory, 'index.sqlite'), timeout=30, check_same_thread=False)
+        with self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, sha256 TEXT NOT NULL, size INTEGER NOT NULL, meta TEXT NOT NULL, last_access REAL NOT NULL)')
+
+    def get(self, key: str) -> tuple[bytes,dict]:
+        """Returns (content, metadata) stored for the key, or None if it isn't cached."""
+        with self._lock:
+            row = self._connection.execute('SELECT sha256, meta FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None: return None
+            sha256,meta = row
+            try:
+                with open(self.__blob_path(sha256), 'rb') as f: content = f.read()
+            except FileNotFoundError: # evicted by another process in the meantime
+                with self._connection: self._connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+                return None
+            with self._connection: self._connection.execute('UPDATE entries SET last_access = ? WHERE key = ?', (time.time(), key))
+        return content, json.loads(meta)
+
+    def put(self, key: str, content: bytes, meta: dict = None):
+        """Stores the content (and its metadata) under the key, then evicts least recently used entries if the cache is too big."""
+        sha256 = hashlib.sha256(content).hexdigest()
+        blob_path = self.__blob_path(sha256)
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            temp_path = f'{blob_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            with open(temp_path, 'wb') as f: f.write(content)
+            os.replace(temp_path, blob_path) # atomic, so readers never see half a file
+        with self._lock:
+            with self._connection:
+                self._connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)', (key, sha256, len(content), json.dumps(meta or {}), time.time()))
+            self.__evict()
+
+    def touch(self, key: str):
+        """Marks the entry as just used."""
+        with self._lock:
+            with self._connection: self._connection.execute('UPDATE entries SET last_access = ? WHERE key = ?', (time.time(), key))
+
+    def __evict(self):
+        total_size = self._connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total_size <= self.max_bytes: return
+        rows = self._connection.execute('SELECT key, sha256, size FROM entries ORDER BY last_access').fetchall()
+        with self._connection:
+            for key,sha256,size in rows:
+                if total_size <= self.max_bytes: break
+                self._connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+                total_size -= size
+                still_used = self._connection.execute('SELECT 1 FROM entries WHERE sha256 = ? LIMIT 1', (sha256,)).fetchone()
+                if still_used is None:
+                    try: os.remove(self.__blob_path(sha256))
+                    except FileNotFoundError: pass
+
+    def __blob_path(self, sha256: str) -> str:
+        return os.path.join(self.directory, 'blobs', sha256[:2], sha256)
+
+
+def get_cache() -> Cache:
+    """Returns the cache of this process (created on first use), or None if caching is turned off (config.use_cache)."""
+    global _cache
+    if not config.use_cache: return None
+    with _cache_lock:
+        if _cache is None: _cache = Cache(config.cache_directory, config.cache_max_bytes)
+    return _cache
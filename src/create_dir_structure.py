@@ -1,9 +1,13 @@
 import os
 
+import config
+
 def create_output_directories():
     """Makes the folder structures for the program output if not already created.
+    The debug image folders are only made if debug images are written (config.debug_level).
     """
     os.makedirs('output', exist_ok=True)
+    if config.debug_level == 'off': return
     os.makedirs('images_for_debugging_and_analysis', exist_ok=True)
     os.makedirs(os.path.join('images_for_debugging_and_analysis','1_base_image'), exist_ok=True)
     os.makedirs(os.path.join('images_for_debugging_and_analysis','2_image_with_all_contours'), exist_ok=True)
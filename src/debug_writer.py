@@ -0,0 +1,90 @@
+import json
+import os
+import queue
+import threading
+import traceback
+import zipfile
+from io import BytesIO
+
+import cv2
+
+import config
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+class DebugImageWriter:
+    """Writes debug images to disk on a background thread, so processing doesn't wait for PNG encoding or disk writes.
+    The debug image callables are also only called on the background thread.
+    The queue is bounded (so pending images can't pile up in memory); if it is full, submit waits for a free slot.
+
+    Args:
+        directory (str): root folder of the debug images (one sub folder per debug image type)
+        queue_size (int): maximum number of debug images waiting to be written
+        png_compression (int): PNG compression level, 0 (fastest, biggest files) to 9
+    """
+    def __init__(self, directory: str, queue_size: int, png_compression: int) -> None:
+        self.directory = directory
+        self.png_compression = png_compression
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = threading.Thread(target=self.__run, name='debug-image-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, name: str, folder: str, get_image):
+        """Queues a debug image to be written.
+
+        Args:
+            name (str): link name of the document, used as the file name
+            folder (str): debug image folder name
+            get_image (callable): returns the image - a MatLike, a BytesIO of a png, or for 14_cells a list of MatLikes
+        """
+        self._queue.put((name, folder, get_image))
+
+    def flush(self):
+        """Waits until every queued debug image has been written."""
+        self._queue.join()
+
+    def __run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                self.__write(*item)
+            except Exception:
+                print(traceback.format_exc())
+            finally:
+                self._queue.task_done()
+
+    def __write(self, name: str, folder: str, get_image):
+        image = get_image()
+        if folder == '14_cells':
+            # one archive per document, instead of hundreds of tiny files
+            index = []
+            with zipfile.ZipFile(os.path.join(self.directory, folder, f'{name}.zip'), 'w', zipfile.ZIP_STORED) as archive: # PNGs are already compressed
+                for i,cell_image in enumerate(image):
+                    archive.writestr(f'{i}.png', self.__encode_png(cell_image))
+                    index.append({'file': f'{i}.png', 'width': cell_image.shape[1], 'height': cell_image.shape[0]})
+                archive.writestr('index.json', json.dumps(index, indent=1))
+        elif isinstance(image, BytesIO):
+            with open(os.path.join(self.directory, folder, f'{name}.png'), 'wb') as f: f.write(image.getvalue())
+        else:
+            with open(os.path.join(self.directory, folder, f'{name}.png'), 'wb') as f: f.write(self.__encode_png(image))
+
+    def __encode_png(self, image) -> bytes:
+        _,encoded_image = cv2.imencode('.png', image, [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression])
+        return encoded_image.tobytes()
+
+
+def get_debug_writer() -> DebugImageWriter:
+    """Returns the debug image writer of this process (created on first use)."""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = DebugImageWriter('images_for_debugging_and_analysis', config.debug_queue_size, config.debug_png_compression)
+    return _writer
+
+
+def flush_debug_writer():
+    """Waits for the debug images queued so far to be written. Does nothing if no debug images were ever written."""
+    if _writer is not None: _writer.flush()
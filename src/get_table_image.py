@@ -1,11 +1,14 @@
+import hashlib
 from io import BytesIO
-from PIL import Image
 
 import fitz # this is pymupdf
 
+from src.cache import Cache
+import config
+
 
 class TableImageException(Exception):
-    """Raised if PDF has no pages or the page has no or more than 1 image, so we can't extract the table image.
+    """Raised if PDF has no pages or the page has no image (and nothing drawn on it to render instead), so we can't extract the table image.
 
     Args:
         Can pass in a string message.
@@ -14,33 +17,42 @@ class TableImageException(Exception):
         self.message = message
         super().__init__(self.message)
 
-def get_table_image_from_pdfbytesio(pdf_bytesio: BytesIO) -> tuple[bytes,str]:
+def get_table_image_from_pdfbytesio(pdf_bytesio: BytesIO, cache: Cache = None) -> tuple[bytes,str,int]:
     """Gets image of the table from the PDF.
     Image is expected to be in page 1 of 1-paged PDFs and page 2 of other PDFs.
     If more than one image is found, largest image is returned (sometimes you may get 2nd images like the camscanner logo).
-    Image orientation is corrected if necessary.
+    If the page has no image but has text or drawings on it (the table isn't scanned), the page is rendered (see render_page) and that image is returned.
+    The image bytes are returned as they are stored in the PDF, along with the angle the decoded image must be rotated by
+    to display correctly (see image_processing.rotate_image) - so it is only decoded once, and never re-encoded.
+    If a cache is given, the result is cached by the sha256 of the PDF, so the same PDF is only ever opened once.
 
     Args:
         pdf_bytesio (io.BytesIO): PDF as BytesIO
+        cache (Cache, optional): cache to read the table image from and store it in. Defaults to None (no caching).
 
     Raises:
-        TableImageException: If found no or more than one image in the target page.
+        TableImageException: If the PDF has no pages, or the target page has no image and nothing to render.
 
     Returns:
-        tuple[bytes,str]: tuple of bytes representing the image, and its extension without the dot(eg: jpeg, not .jpeg)
+        tuple[bytes,str,int]: tuple of bytes representing the image, its extension without the dot(eg: jpeg, not .jpeg),
+        and the angle to rotate it by clockwise (0, 90, -90 or 180)
     """
 
-    fitz_file = fitz.open("pdf", pdf_bytesio)
+    if cache is not None:
+        cache_key = f'table_image_v2:{hashlib.sha256(pdf_bytesio.getvalue()).hexdigest()}'
+        cached = cache.get(cache_key)
+        if cached is not None: return (cached[0], cached[1]['ext'], cached[1]['angle'])
+        image_bytes,image_ext,angle = get_table_image_from_pdfbytesio(pdf_bytesio)
+        cache.put(cache_key, image_bytes, {'ext': image_ext, 'angle': angle})
+        return (image_bytes,image_ext,angle)
 
-    if fitz_file.page_count >= 2:
-        interested_page_index = 1
-    elif fitz_file.page_count == 1:
-        interested_page_index = 0
-    else:
-        raise TableImageException('PDF file has no pages!')
-    page = fitz_file.load_page(interested_page_index) 
+    fitz_file = fitz.open("pdf", pdf_bytesio)
+    page = get_target_page(fitz_file)
     image_list = page.get_images(full=True) 
-    if len(image_list) == 0: raise TableImageException('Found no image in PDF target page.')
+    if len(image_list) == 0:
+        # the table may be drawn on the page (text and lines) rather than scanned - then the page itself is the table image
+        if not page.get_text().strip() and len(page.get_drawings()) == 0: raise TableImageException('Found no image in PDF target page.')
+        return (render_page(page), 'pgm', 0)
 
     largest_image_size = 0
     for image in image_list:
@@ -59,9 +71,39 @@ def get_table_image_from_pdfbytesio(pdf_bytesio: BytesIO) -> tuple[bytes,str]:
             largest_image_size = image_size
             image_bytes: bytes = base_image["image"]
             image_ext = base_image["ext"]
-            image_bytes = rotate_bytes_image(image_bytes, float(-angle_correction), image_ext)
+            image_angle = angle_correction
+
+    return (image_bytes,image_ext,image_angle)
+
+
+def get_target_page(fitz_file: fitz.Document) -> fitz.Page:
+    """The page with the table: page 1 of 1-paged PDFs and page 2 of other PDFs.
+
+    Raises:
+        TableImageException: If the PDF has no pages.
+    """
+    if fitz_file.page_count >= 2:
+        interested_page_index = 1
+    elif fitz_file.page_count == 1:
+        interested_page_index = 0
+    else:
+        raise TableImageException('PDF file has no pages!')
+    return fitz_file.load_page(interested_page_index)
 
-    return (image_bytes,image_ext)
+
+def render_page(page: fitz.Page, dpi: int = None) -> bytes:
+    """Renders the page (as it is displayed, so already rotated correctly) to a grayscale image, for pages without a scanned image of the table.
+    Returned as PGM - little more than the raw pixels, so it costs next to nothing to encode and decode.
+
+    Args:
+        page (fitz.Page): the page
+        dpi (int, optional): resolution to render at. Defaults to config.vector_page_render_dpi.
+
+    Returns:
+        bytes: the PGM image
+    """
+    if dpi is None: dpi = config.vector_page_render_dpi
+    return page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False).tobytes('pgm')
 
 
 def getAngleTheOriginalImageHasBeenRotatedToDisplayCorrectly(transform: fitz.Matrix):
@@ -70,10 +112,3 @@ def getAngleTheOriginalImageHasBeenRotatedToDisplayCorrectly(transform: fitz.Mat
     if a < 0: return 180
     if b < 0: return -90
     return 90
-
-def rotate_bytes_image(image: bytes, angle_deg: float, image_ext: str) -> bytes:
-    img = Image.open(BytesIO(image))
-    rotated_image = img.rotate(angle_deg, expand=True)
-    result = BytesIO()
-    rotated_image.save(result,format=image_ext)
-    return result.getvalue()
@@ -4,17 +4,19 @@ import numpy as np
 import cv2
 from cv2.typing import MatLike
 
+import config
 
-def get_larger_contours_from_image(image: MatLike) -> tuple[list,MatLike,MatLike]:
+
+def get_larger_contours_from_image(image: MatLike) -> tuple[list,dict]:
     """Returns just the contours with larger area from the image that is passed in.
-    2 additional MatLikes are returned for debugging and analysis.
     Hopefully the larger contours only represent the cells and table structures, not words/letters.
+    Debug images are also returned, as callables that only draw them when called (see output.persist_debugging_images).
 
     Args:
         image (MatLike): _description_
 
     Returns:
-        tuple[list,MatLike,MatLike]: larger_contours, image_with_larger_contours, image_with_all_contours
+        tuple[list,dict]: larger_contours, debug images ('image_with_larger_contours' and 'image_with_all_contours')
     """
 
 
@@ -23,23 +25,75 @@ def get_larger_contours_from_image(image: MatLike) -> tuple[list,MatLike,MatLike
 
     # apply canny edge detection and get all contour points
     edged = cv2.Canny(image, 30, 180)
-    all_contours,hierachy = cv2.findContours(edged.copy(), cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
-    image_with_all_contours = image.copy()
-    cv2.drawContours(image_with_all_contours, all_contours, -1, (0,0,255), 3)
+    all_contours,hierachy = cv2.findContours(edged, cv2.RETR_LIST, cv2.CHAIN_APPROX_NONE)
 
     # get the larger contours only
     # (hopefully those representing cells, and not words/letters)
-    all_contours_sorted = sorted(all_contours, key=cv2.contourArea, reverse=True)
+    larger_contours = select_larger_contours(all_contours, image_area)
+
+    debug_images = {
+        'image_with_larger_contours': lambda: draw_contours(image, larger_contours),
+        'image_with_all_contours': lambda: draw_contours(image, all_contours),
+    }
+    return larger_contours, debug_images
+
+def select_larger_contours(contours: list, image_area: int, min_ratio_of_image_area: float = 0.00086) -> list:
+    """Goes through the contours from largest to smallest area, keeping them until the first one whose bounding rect
+    is smaller than min_ratio_of_image_area of the image. Returns the kept contours, largest area first.
+    This is a small part of get_larger_contours_from_image compared to Canny and findContours (see benchmarks/contour_selection.py).
+
+    Args:
+        contours (list): contours, as returned by cv2.findContours
+        image_area (int): area of the image the contours were found in
+        min_ratio_of_image_area (float, optional): Defaults to 0.00086.
+
+    Returns:
+        list: the larger contours, sorted by area (largest first)
+    """
+    contours_sorted = sorted(contours, key=cv2.contourArea, reverse=True)
     larger_contours = []
-    for contour in all_contours_sorted:
+    for contour in contours_sorted:
         x,y,w,h = cv2.boundingRect(contour)
         area_of_boundingRect = w*h
-        if area_of_boundingRect/image_area < 0.00086: break
+        if area_of_boundingRect/image_area < min_ratio_of_image_area: break
         larger_contours.append(contour)
-    image_with_larger_contours = image.copy()
-    cv2.drawContours(image_with_larger_contours, larger_contours, -1, (0,0,255), 3)
+    return larger_contours
+
+def get_working_resolution_image(image: MatLike) -> tuple[MatLike,float]:
+    """Scales the image down so that its longer edge is config.working_resolution_long_edge pixels.
+    Returns the scaled down image and the scale factor, or the image itself and 1.0 if it is already small enough (or the setting is None)."""
+    long_edge = config.working_resolution_long_edge
+    if long_edge is None or max(image.shape[:2]) <= long_edge: return image, 1.0
+    scale = long_edge / max(image.shape[:2])
+    return cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA), scale
 
-    return larger_contours, image_with_larger_contours, image_with_all_contours
+def scale_contours(contours: list, factor: float) -> list:
+    """Returns the contours with their point coordinates multiplied by the factor (eg: back to full resolution)."""
+    return [np.rint(contour * factor).astype(np.int32) for contour in contours]
+
+def transform_contours(contours: list, M: np.ndarray, image_width: int, image_height: int) -> list:
+    """Moves the contours with the perspective transform matrix M (eg: into the unwarped image).
+    Points that end up outside the image are clipped to its edge - dropping them would join the points on either side of the gap
+    with a straight line across the image, which gets drawn over content (eg: when the gridlines are removed).
+    Contours entirely outside the image are dropped."""
+    if len(contours) == 0: return []
+    lengths = [len(contour) for contour in contours]
+    points = np.concatenate([contour.reshape(-1,1,2) for contour in contours]).astype(np.float32)
+    points = np.rint(cv2.perspectiveTransform(points, M))
+    transformed_contours = []
+    for contour in np.split(points, np.cumsum(lengths)[:-1]):
+        inside = (contour[:,0,0] >= 0) & (contour[:,0,0] < image_width) & (contour[:,0,1] >= 0) & (contour[:,0,1] < image_height)
+        if not inside.any(): continue
+        contour[:,0,0] = np.clip(contour[:,0,0], 0, image_width-1)
+        contour[:,0,1] = np.clip(contour[:,0,1], 0, image_height-1)
+        transformed_contours.append(contour.astype(np.int32))
+    return transformed_contours
+
+def draw_contours(image: MatLike, contours: list, color: tuple = (0,0,255), thickness: int = 3) -> MatLike:
+    """Returns a copy of the image with the contours drawn on it (for debugging and analysis)."""
+    image_with_contours = image.copy()
+    cv2.drawContours(image_with_contours, contours, -1, color, thickness)
+    return image_with_contours
 
 def convert_bytes_to_openCV_matlike(bytes: bytes) -> MatLike:
     """Converts the bytes of an image read from somwhere (like a stream or the file system)
@@ -51,6 +105,22 @@ def convert_bytes_to_openCV_matlike(bytes: bytes) -> MatLike:
     Returns:
         matlike: matlike image
     """
-    numpy_array = np.fromstring(bytes, np.uint8)
+    numpy_array = np.frombuffer(bytes, np.uint8)
     img = cv2.imdecode(numpy_array, cv2.IMREAD_COLOR)
     return img
+
+def rotate_image(image: MatLike, angle: int) -> MatLike:
+    """Rotates the image clockwise by a multiple of 90 degrees (eg: the angle returned by get_table_image.get_table_image_from_pdfbytesio).
+
+    Args:
+        image (MatLike): image to rotate
+        angle (int): 0, 90, -90 (ie: 90 anticlockwise) or 180
+
+    Returns:
+        MatLike: the rotated image (the image itself if angle is 0)
+    """
+    if angle == 0: return image
+    if angle == 90: return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+    if angle == -90: return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    if angle == 180: return cv2.rotate(image, cv2.ROTATE_180)
+    raise ValueError(f'Can only rotate by 0, 90, -90 or 180 degrees, not {angle}')
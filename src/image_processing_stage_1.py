@@ -14,79 +14,111 @@ def distance_between_2coords(a,b) -> float:
     return math.sqrt(term1 + term2)
 
 def __find_corners_of_table(external_contours,base_image_width,base_image_height):
-    """Use the outer contour points detected to infer the 4 corners of the table"""
-    top_left_min_dist = 1000000; top_right_min_dist = 1000000; bottom_left_min_dist = 1000000; bototom_right_min_dist = 1000000
-
-    for contour in external_contours:
-        for point in contour:
-            x = point[0][0]
-            y = point[0][1]
-            dist = distance_between_2coords((x,y),(0,0))
-            if dist < top_left_min_dist: 
-                top_left = (x,y)
-                top_left_min_dist = dist
-            dist = distance_between_2coords((x,y),(base_image_width,0))
-            if dist < top_right_min_dist: 
-                top_right = (x,y)
-                top_right_min_dist = dist
-            dist = distance_between_2coords((x,y),(base_image_width,base_image_height))
-            if dist < bototom_right_min_dist:  
-                bottom_right = (x,y)
-                bototom_right_min_dist = dist
-            dist = distance_between_2coords((x,y),(0,base_image_height))
-            if dist < bottom_left_min_dist:  
-                bottom_left = (x,y)
-                bottom_left_min_dist = dist
-    
+    """Use the outer contour points detected to infer the 4 corners of the table.
+    Each table corner is the contour point closest to the corresponding image corner (the first one, if there is a tie)."""
+    points = np.concatenate([contour.reshape(-1,2) for contour in external_contours]).astype(np.int64)
+    image_corners = np.array([(0,0),(base_image_width,0),(base_image_width,base_image_height),(0,base_image_height)], np.int64)
+
+    # squared distance of every point (rows) to every image corner (columns). Squaring keeps the order, so no need for sqrt.
+    squared_distances = ((points[:,None,:] - image_corners[None,:,:])**2).sum(axis=2)
+    closest_point_indexes = squared_distances.argmin(axis=0)
+    top_left,top_right,bottom_right,bottom_left = (tuple(int(value) for value in points[i]) for i in closest_point_indexes)
+
     return top_left,top_right,bottom_right,bottom_left
 
 
-def process_stage_1(base_image: MatLike) -> tuple[MatLike,MatLike,MatLike,MatLike,MatLike,tuple]:
+def process_stage_1(base_image: MatLike) -> tuple[MatLike,tuple,np.ndarray,list,dict]:
     """This takes the base image ripped from the PDF, applies a bilateral filter to it and unwarps the table to 
     correct for angle when it was scanned/photographed (perspective transform).
+    If config.working_resolution_long_edge is set, the table corners are found on a scaled down copy of the image and scaled back up.
 
     The primary expected return is the unwarped_base_image - which contains the perspective transformed table.
-    However 4 other MatLike objects are returned in case they are needed for debugging and analysis.
-    The final return is a tuple of 4 points representing the 4 corners of the table (the points themselves are tuples of x,y format). This is also for the purpose of debugging and analysis.
+    The 2nd return is a tuple of 4 points representing the 4 corners of the table (the points themselves are tuples of x,y format).
+    The 3rd and 4th are the perspective transform matrix and the larger contours of the base image (stage 2 can reuse them, moved into the unwarped image with the matrix).
+    The final return is a dict of debug images for debugging and analysis. They are callables, so the images are only drawn if they are written (see output.persist_debugging_images).
 
     Args:
         base_image (MatLike): the base image ripped from the PDF
 
     Returns:
-        tuple[MatLike,MatLike,MatLike,MatLike,MatLike,tuple]: unwarped_base_image,image_with_all_contours,image_with_larger_contours,larger_contours_mask_image,retr_external_img, points of the 4 table corners
+        tuple[MatLike,tuple,np.ndarray,list,dict]: unwarped_base_image, points of the 4 table corners, perspective transform matrix, larger contours, debug images
     """
 
 
     base_image_height,base_image_width,base_image_channels = base_image.shape
 
+    # the table corners can be found on a scaled down copy (see config.working_resolution_long_edge)
+    working_image, scale = image_processing.get_working_resolution_image(base_image)
+    working_image_height,working_image_width = working_image.shape[:2]
+
     # Apply bilateral filter. It keeps edges sharp while removing noise. Example: https://docs.opencv.org/4.x/d4/d13/tutorial_py_filtering.html
-    bfilter = cv2.bilateralFilter(base_image, 13, 20, 20)
+    bfilter = cv2.bilateralFilter(working_image, 13, 20, 20)
 
-    larger_contours, image_with_larger_contours, image_with_all_contours = image_processing.get_larger_contours_from_image(bfilter)
+    larger_contours, contour_debug_images = image_processing.get_larger_contours_from_image(bfilter)
 
     # Create mask of the points comprising the larger_contours
-    larger_contours_mask_image = np.zeros((base_image_height,base_image_width,3), np.uint8)
-    larger_contours_mask_image = cv2.cvtColor(larger_contours_mask_image,cv2.COLOR_BGR2GRAY)
+    larger_contours_mask_image = np.zeros((working_image_height,working_image_width), np.uint8)
     cv2.drawContours(larger_contours_mask_image, larger_contours, -1, (255), 3)
 
     # Find the outer contour(s) points using the mask
-    ext_contours,hierachy = cv2.findContours(larger_contours_mask_image.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    retr_external_img = base_image.copy()
-    cv2.drawContours(retr_external_img, ext_contours, -1, (255), 3)
+    ext_contours,hierachy = cv2.findContours(larger_contours_mask_image, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
     # Use the outer contour points detected to infer the 4 corners of the table
-    top_left,top_right,bottom_right,bottom_left = __find_corners_of_table(ext_contours,base_image_width,base_image_height)
+    top_left,top_right,bottom_right,bottom_left = __find_corners_of_table(ext_contours,working_image_width,working_image_height)
+    table_corners = (top_left,top_right,bottom_right,bottom_left)
+    if scale != 1.0:
+        table_corners = tuple((round(x/scale),round(y/scale)) for x,y in table_corners)
+        top_left,top_right,bottom_right,bottom_left = table_corners
+        larger_contours_of_base_image = image_processing.scale_contours(larger_contours, 1/scale)
+    else:
+        larger_contours_of_base_image = larger_contours
 
     # Unwarp the base image using the identified table corners
     pts1 = np.float32([top_left,top_right,bottom_left,bottom_right])
     pts2 = np.float32([[0,0],[base_image_width,0],[0,base_image_height],[base_image_width,base_image_height]])
     M = cv2.getPerspectiveTransform(pts1,pts2)
     ## might as well apply unwarping to the bilateral-filtered base_image
-    unwarped_base_image = cv2.warpPerspective(bfilter,M,(base_image_width,base_image_height))
-
-    return unwarped_base_image,image_with_all_contours,image_with_larger_contours,larger_contours_mask_image,retr_external_img,(top_left,top_right,bottom_right,bottom_left)
+    ## (at a lower working resolution, the full resolution image is unwarped unfiltered - filtering it would cost more than everything else in this stage)
+    unwarped_base_image = cv2.warpPerspective(bfilter if scale == 1.0 else base_image,M,(base_image_width,base_image_height))
 
+    debug_images = {
+        '2_image_with_all_contours': contour_debug_images['image_with_all_contours'],
+        '3_image_with_larger_contours': contour_debug_images['image_with_larger_contours'],
+        '4_larger_contours_mask_image': lambda: larger_contours_mask_image,
+        '5_retr_external_img': lambda: image_processing.draw_contours(working_image, ext_contours, (255,0,0)),
+        '6_table_corner_image': lambda: draw_table_corners(unwarped_base_image, table_corners),
+        '7_unwarped_base_image': lambda: unwarped_base_image,
+    }
+    return unwarped_base_image,table_corners,M,larger_contours_of_base_image,debug_images
 
 
+def get_warp_distortion(table_corners: tuple, image_width: int, image_height: int) -> float:
+    """How unevenly the unwarping scales the table: the largest factor an edge of the table is scaled by, over the smallest.
+    1.0 if it is scaled evenly - eg: a table that is smaller than the image but not photographed at an angle, however small it is.
+    Perspective (the far edge gets scaled up more than the near one) or a changed aspect ratio make it larger.
 
+    Args:
+        table_corners (tuple): the 4 table corners returned by process_stage_1
+        image_width (int): width of the base image
+        image_height (int): height of the base image
 
+    Returns:
+        float: the largest edge scale factor over the smallest (inf if the corners coincide)
+    """
+    top_left,top_right,bottom_right,bottom_left = table_corners
+    edges = ((top_left,top_right,image_width),(bottom_left,bottom_right,image_width),
+             (top_left,bottom_left,image_height),(top_right,bottom_right,image_height))
+    scales = []
+    for a,b,unwarped_length in edges:
+        length = distance_between_2coords(a,b)
+        if length == 0: return math.inf
+        scales.append(unwarped_length/length)
+    return max(scales)/min(scales)
+
+
+def draw_table_corners(image: MatLike, table_corners: tuple) -> MatLike:
+    """Returns a copy of the image with the 4 table corners marked (for debugging and analysis)."""
+    table_corner_image = image.copy()
+    for corner in table_corners:
+        cv2.circle(table_corner_image,corner,5,(0,0,255),-1)
+    return table_corner_image
@@ -1,42 +1,75 @@
-import math
+import importlib
 from io import BytesIO
 
 import numpy as np
 import cv2
 from cv2.typing import MatLike
-import matplotlib.pyplot as plt
-import scipy.signal as sp_sig
 
 from src import image_processing
 
 
-def get_histogram(frequencies: list, max_axis_value: int) -> BytesIO:
+def get_histogram(frequencies: np.ndarray, max_axis_value: int) -> BytesIO:
     """Plots the frequencies as a histogram for visualization.
 
     Args:
-        frequencies (list): _description_
+        frequencies (np.ndarray): _description_
         max_axis_value (int): something like max_x or max_y must come here
 
     Returns:
         BytesIO: image of the plot
     """
-    x_axis = list(range(max_axis_value+1))
-    plt.bar(x_axis, frequencies, color='skyblue', edgecolor='black')
-    plt.xlabel('Axis')
-    plt.ylabel('Frequency')
-    plt.title('Histogram of Detected Contour Points (Larger)')
+    from matplotlib.figure import Figure # only needed for debugging, so only imported when a plot is actually drawn
+
+    x_axis = np.arange(max_axis_value+1)
+    figure = Figure()
+    axes = figure.subplots()
+    axes.bar(x_axis, frequencies, color='skyblue', edgecolor='black')
+    axes.set_xlabel('Axis')
+    axes.set_ylabel('Frequency')
+    axes.set_title('Histogram of Detected Contour Points (Larger)')
     plot_bytes_io = BytesIO()
-    plt.savefig(plot_bytes_io, format='png')
-    plt.close()
+    figure.savefig(plot_bytes_io, format='png')
     plot_bytes_io.seek(0)
     return plot_bytes_io
 
 
-def get_table_lines(frequncies: list, image_shape, vertical: bool, min_ratio_of_highest_prominence: float = 0.25) -> list:
+def draw_grid(image: MatLike, vertical_lines: list, horizontal_lines: list) -> MatLike:
+    """Returns a copy of the image with the identified row and column lines drawn on it (for debugging and analysis)."""
+    image_with_final_grid = image.copy()
+    for line in horizontal_lines:
+        cv2.line(image_with_final_grid, line[0], line[1], (0,0,255), 3)
+    for line in vertical_lines:
+        cv2.line(image_with_final_grid, line[0], line[1], (0,0,255), 3)
+    return image_with_final_grid
+
+
+def get_contour_point_frequencies(contours: list) -> tuple[np.ndarray,np.ndarray]:
+    """Counts the (unique) points of the contours at each x and at each y coordinate.
+
+    Args:
+        contours (list): contours, as returned by cv2.findContours
+
+    Returns:
+        tuple[np.ndarray,np.ndarray]: x_frequencies, y_frequencies - x_frequencies[x] is the number of points with that x. Lengths are max_x+1 and max_y+1.
+    """
+    if len(contours) == 0: return np.zeros(1, np.int64), np.zeros(1, np.int64)
+
+    points = np.concatenate([contour.reshape(-1,2) for contour in contours])
+    max_x = int(points[:,0].max()); max_y = int(points[:,1].max())
+
+    # avoid duplicates - mark each point on a boolean image, a duplicate point just marks the same pixel again
+    point_mask = np.zeros((max_y+1,max_x+1), bool)
+    point_mask[points[:,1], points[:,0]] = True
+    x_frequencies = np.count_nonzero(point_mask, axis=0)
+    y_frequencies = np.count_nonzero(point_mask, axis=1)
+    return x_frequencies, y_frequencies
+
+
+def get_table_lines(frequncies: np.ndarray, image_shape, vertical: bool, min_ratio_of_highest_prominence: float = 0.25) -> list:
     """Uses scipy signal library peak detection to identify peaks and their width (the width is used because the lines may not be perfectly vertical or horizontal)
 
     Args:
-        frequncies (list): x_frequencies when searching for vertical lines, y_frequencies otherwise
+        frequncies (np.ndarray): x_frequencies when searching for vertical lines, y_frequencies otherwise
         image_shape (_type_): enter the image.shape property here
         vertical (bool): Is the search for vertical lines (columns) or horizontal lines (rows)?
         min_ratio_of_highest_prominence (float, optional): _description_. Defaults to 0.25. This will determine the lower bound of prominence for a peak to be identified as a ratio of the most prominent peak.
@@ -55,29 +88,19 @@ def get_table_lines(frequncies: list, image_shape, vertical: bool, min_ratio_of_
         primary_limit = image_width
         min_distance_between_peaks = int(primary_limit*(30/2000))
 
+    import scipy.signal as sp_sig # takes over a second to import, so only when it is needed (not on every start of main.py)
     peaks, properties = sp_sig.find_peaks(frequncies, prominence=1, distance=min_distance_between_peaks, width=1)
 
-    peaks_with_properties = []
-
-    for i in range(0,len(peaks)):
-        peak = peaks[i]
-        dictionary = {}
-        dictionary['prominence'] = properties['prominences'][i]
-        # dictionary['widths'] = properties['widths'][i]
-        dictionary['left_ips'] = properties['left_ips'][i]
-        dictionary['right_ips'] = properties['right_ips'][i]
-        peaks_with_properties.append((peak,dictionary))
-
-    peaks_with_properties.sort(key=lambda x: x[1]['prominence'], reverse=True)
-    max_prominence_item = peaks_with_properties[0][1]['prominence']
+    # most prominent peaks first. Stable sort, so equally prominent peaks stay in order of position.
+    prominences = properties['prominences']
+    order = np.argsort(-prominences, kind='stable')
+    order = order[prominences[order] >= prominences[order[0]]*min_ratio_of_highest_prominence]
 
     lines = []
 
-    for peak in peaks_with_properties:
-        prominence = peak[1]['prominence']
-        if prominence < max_prominence_item*min_ratio_of_highest_prominence: break
-        left_ips = peak[1]['left_ips']
-        right_ips = peak[1]['right_ips']
+    for i in order:
+        left_ips = properties['left_ips'][i]
+        right_ips = properties['right_ips'][i]
         if vertical: lines.append(((round(left_ips),0),(round(right_ips),primary_limit)))
         else: lines.append(((0,round(left_ips)),(primary_limit,round(right_ips))))
 
@@ -94,63 +117,71 @@ def get_table_lines(frequncies: list, image_shape, vertical: bool, min_ratio_of_
     return lines
 
 
-def process_stage_2(unwarped_base_image: MatLike) -> tuple[list, list, BytesIO, BytesIO, MatLike, MatLike]:
+def warm_up():
+    """Imports the modules get_table_lines imports lazily (scipy.signal takes over a second), so that a long running process
+    (eg: main.py --daemon) doesn't make its first document wait for them."""
+    importlib.import_module('scipy.signal')
+
+
+def scale_lines(lines: list, x_factor: float, y_factor: float) -> list:
+    """Returns the lines with their x coordinates multiplied by x_factor and y coordinates by y_factor."""
+    return [tuple((round(x*x_factor),round(y*y_factor)) for x,y in line) for line in lines]
+
+
+def process_stage_2(unwarped_base_image: MatLike, larger_contours: list = None) -> tuple[list, list, list, dict]:
     """Identifies the row and column gridlines from the unwarped base image. 
-    Primary expected return are the lists of these 2 sets of lines, other images of the processing stages are also returned for debugging and analysis.
+    Primary expected return are the lists of these 2 sets of lines. The larger contours are also returned (stage 3 uses them to remove the gridlines),
+    along with a dict of debug images for debugging and analysis (callables, so they are only drawn if they are written - see output.persist_debugging_images).
     The lines are identified by getting the frequencies of the points comprising the larger contours across the vertical and horizontal axes.
     A peak detection algorithm from scipy signal library can be used to identify the location of peaks and their widths (widths bcuz lines may not be perfectly vertical/horizontal)
+    If config.working_resolution_long_edge is set, this is done on a scaled down copy of the image and the lines and contours are scaled back up.
 
     Args:
         unwarped_base_image (MatLike): image containing just the table (4 corners of the table must be the corners of the image)
+        larger_contours (list, optional): larger contours already found in the unwarped base image (eg: stage 1's, moved with the perspective transform). Found again if None.
 
     Returns:
-        tuple[list, list, BytesIO, BytesIO, MatLike, MatLike]: vertical_lines,horizontal_lines,plot_for_columns,plot_for_rows,unwarped_base_image_with_larger_contours,unwarped_base_image_with_all_contours
+        tuple[list, list, list, dict]: vertical_lines,horizontal_lines,larger_contours,debug images
     """
 
-    larger_contours, unwarped_base_image_with_larger_contours, unwarped_base_image_with_all_contours = image_processing.get_larger_contours_from_image(unwarped_base_image)
+    # the gridlines can be found on a scaled down copy (see config.working_resolution_long_edge)
+    working_image, scale = image_processing.get_working_resolution_image(unwarped_base_image)
+
+    if larger_contours is None:
+        working_larger_contours, contour_debug_images = image_processing.get_larger_contours_from_image(working_image)
+        larger_contours = working_larger_contours if scale == 1.0 else image_processing.scale_contours(working_larger_contours, 1/scale)
+    else:
+        working_larger_contours = larger_contours if scale == 1.0 else image_processing.scale_contours(larger_contours, scale)
+        contour_debug_images = {'image_with_larger_contours': lambda: image_processing.draw_contours(working_image, working_larger_contours)}
 
     # get the frequencies (x_frequencies,y_frequencies) of the larger_contours points in the x and y axes of the image
-    points = set()
-    max_x = 0; max_y = 0
-    x_frequencies_dict = {}; y_frequencies_dict = {}
-
-    for contour in larger_contours:
-        for point in contour:
-            x = point[0][0] # for some reason a 'point' is nested inside an array
-            y = point[0][1]
-            if (x,y) in points: continue # avoid duplicates
-            points.add((x,y))
-            if x not in x_frequencies_dict.keys(): x_frequencies_dict[x] = 1
-            else: x_frequencies_dict[x] += 1
-            if y not in y_frequencies_dict.keys(): y_frequencies_dict[y] = 1
-            else: y_frequencies_dict[y] += 1
-            max_x = max(max_x,x)
-            max_y = max(max_y,y)
-
-    x_frequencies = []; y_frequencies = []
-    for _ in range(0,max_x+1): x_frequencies.append(0)
-    for _ in range(0,max_y+1): y_frequencies.append(0)
-
-    for value in x_frequencies_dict.keys(): x_frequencies[value] = x_frequencies_dict[value]
-    for value in y_frequencies_dict.keys(): y_frequencies[value] = y_frequencies_dict[value]
-
-    plot_for_columns = get_histogram(x_frequencies,max_x)
-    plot_for_rows = get_histogram(y_frequencies,max_y)
+    x_frequencies, y_frequencies = get_contour_point_frequencies(working_larger_contours)
+    max_x = len(x_frequencies) - 1; max_y = len(y_frequencies) - 1
 
     # now that we have the frequencies, we can use a peak detection algorithm to determine the column and row lines
     vertical_lines = []
     min_ratio_of_highest_prominence = 0.25
     while len(vertical_lines) < 7:
-        vertical_lines = get_table_lines(x_frequencies,unwarped_base_image.shape,True,min_ratio_of_highest_prominence)
+        # below 0 every peak is already accepted - looping on would never find more lines
+        if min_ratio_of_highest_prominence < 0: raise ValueError(f'Only {len(vertical_lines)} column lines could be identified, 7 are needed')
+        vertical_lines = get_table_lines(x_frequencies,working_image.shape,True,min_ratio_of_highest_prominence)
         min_ratio_of_highest_prominence -= 0.01
-    horizontal_lines = get_table_lines(y_frequencies,unwarped_base_image.shape,False)
-
-    # visual representation of identified row and column lines
-    image_with_final_grid = unwarped_base_image.copy()
-    for line in horizontal_lines:
-        cv2.line(image_with_final_grid, line[0], line[1], (0,0,255), 3)
-    for line in vertical_lines:
-        cv2.line(image_with_final_grid, line[0], line[1], (0,0,255), 3)
-
-    return vertical_lines,horizontal_lines,plot_for_columns,plot_for_rows,unwarped_base_image_with_larger_contours,unwarped_base_image_with_all_contours,larger_contours
-
+    horizontal_lines = get_table_lines(y_frequencies,working_image.shape,False)
+
+    if scale != 1.0:
+        # back to full resolution, so that the cells are cropped from the full resolution image
+        x_factor = unwarped_base_image.shape[1] / working_image.shape[1]
+        y_factor = unwarped_base_image.shape[0] / working_image.shape[0]
+        vertical_lines = scale_lines(vertical_lines, x_factor, y_factor)
+        horizontal_lines = scale_lines(horizontal_lines, x_factor, y_factor)
+
+    debug_images = {
+        '9_unwarped_base_image_with_larger_contours': contour_debug_images['image_with_larger_contours'],
+        '10_plot_for_rows': lambda: get_histogram(y_frequencies,max_y),
+        '11_plot_for_columns': lambda: get_histogram(x_frequencies,max_x),
+        '12_image_with_final_grid': lambda: draw_grid(unwarped_base_image, vertical_lines, horizontal_lines),
+    }
+    # all the contours are only known if they were found here
+    if 'image_with_all_contours' in contour_debug_images:
+        debug_images['8_unwarped_base_image_with_all_contours'] = contour_debug_images['image_with_all_contours']
+    return vertical_lines,horizontal_lines,larger_contours,debug_images
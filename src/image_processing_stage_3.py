@@ -1,13 +1,6 @@
-import math
-from io import BytesIO
-
 import numpy as np
 import cv2
 from cv2.typing import MatLike
-import matplotlib.pyplot as plt
-import scipy.signal as sp_sig
-
-from src import image_processing
 
 def find_intersection_points_per_row(horizontal_lines: list[tuple[tuple[int,int],tuple[int,int]]], 
                                               vertical_lines: list[tuple[tuple[int,int],tuple[int,int]]]):
@@ -73,36 +66,91 @@ def get_cell_coordinates(horizontal_lines: list,vertical_lines: list):
 
 
 def try_to_remove_gridlines(unwarped_base_image: MatLike, unwarped_base_image_larger_contours):
+    """Whitens a 7x7 neighbourhood around every point of the larger contours (hopefully the gridlines).
+    The contours are rasterized into a mask which is dilated with a 7x7 kernel, then applied in a single masked assignment.
+    The contours are drawn as polylines, which for contours from findContours (neighbouring points) is exactly their points,
+    and for contours scaled up from a lower working resolution also fills in the gaps between the points."""
     gridless_image = unwarped_base_image.copy()
+    if len(unwarped_base_image_larger_contours) == 0: return gridless_image
+    image_height,image_width = gridless_image.shape[:2]
 
-    for contour in unwarped_base_image_larger_contours:
-        for point in contour:
-            x = point[0][0]; y = point[0][1]
-            for Y in range(y-3,y+4):
-                for X in range(x-3,x+4):
-                    try: gridless_image[Y,X] = [255,255,255]
-                    except IndexError: continue
+    mask = np.zeros((image_height,image_width), np.uint8)
+    cv2.polylines(mask, [contour.astype(np.int32) for contour in unwarped_base_image_larger_contours], False, 255, 1)
+    mask = cv2.dilate(mask, np.ones((7,7), np.uint8))
+    gridless_image[mask > 0] = 255
 
     return gridless_image
 
 
 def get_cells_by_cropping(cell_coords: list, gridless_image: MatLike):
+    """Crops out the cells. They are numpy views into the gridless image (not copies), so all the cells together
+    take no more memory than the gridless image itself - and must not be modified in place."""
     cell_images = []
     for coords in cell_coords:
         top_left,top_right,bottom_right,bottom_left = coords
-        img = gridless_image.copy()
-        cell = img[top_left[1]:bottom_left[1], top_left[0]:top_right[0]]
+        cell = gridless_image[top_left[1]:bottom_left[1], top_left[0]:top_right[0]]
         cell_images.append(cell)
 
     return cell_images
 
 
-def process_stage_3(horizontal_lines: list, vertical_lines: list, unwarped_base_image: MatLike, unwarped_base_image_larger_contours):
-    cell_coords = get_cell_coordinates(horizontal_lines,vertical_lines)
-    gridless_image = try_to_remove_gridlines(unwarped_base_image, unwarped_base_image_larger_contours)
-    cell_images = get_cells_by_cropping(cell_coords, gridless_image)
-    return cell_images, gridless_image
+def is_blank_cell(cell_image: MatLike, ink_threshold: int = 160, min_component_area: int = 12, border: int = 4) -> bool:
+    """Cheap check for a cell with nothing to OCR: no pixel darker than ink_threshold, or only specks of noise and slivers of leftover gridline
+    (connected components smaller than min_component_area pixels, or at most 2 pixels thick). A band of border pixels along the edges
+    of the cell is ignored, as that is where whatever is left of the gridlines is.
+
+    Args:
+        cell_image (MatLike): cell image (BGR or grayscale)
+        ink_threshold (int, optional): pixels darker than this are ink. Defaults to 160.
+        min_component_area (int, optional): smallest connected blob of ink that counts as a mark. Defaults to 12.
+        border (int, optional): width of the band along the edges that is ignored. Defaults to 4.
+
+    Returns:
+        bool: True if the cell is blank
+    """
+    cell_image = cell_image[border:-border, border:-border]
+    if cell_image.size == 0: return True
+    gray = cv2.cvtColor(cell_image, cv2.COLOR_BGR2GRAY) if cell_image.ndim == 3 else cell_image
+    ink = (gray < ink_threshold).view(np.uint8)
+    if cv2.countNonZero(ink) < min_component_area: return True # ink density check, no need to look at blobs
+
+    _,_,stats,_ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    stats = stats[1:] # label 0 is the background
+    marks = (stats[:,cv2.CC_STAT_AREA] >= min_component_area) & (stats[:,cv2.CC_STAT_WIDTH] > 2) & (stats[:,cv2.CC_STAT_HEIGHT] > 2)
+    return not marks.any()
 
 
+def trim_and_binarize_cell(cell_image: MatLike, margin: int = 10) -> MatLike:
+    """Returns the cell as a single channel black and white image (Otsu threshold), cropped to the bounding box of its ink
+    with a white margin around it (tesseract recognizes text better with some space around it). A cell without ink is returned as a small white image.
 
+    Args:
+        cell_image (MatLike): cell image (BGR or grayscale)
+        margin (int, optional): width of the white margin around the ink. Defaults to 10.
+
+    Returns:
+        MatLike: the trimmed, binarized cell image
+    """
+    if cell_image.size == 0: return cell_image
+    gray = cv2.cvtColor(cell_image, cv2.COLOR_BGR2GRAY) if cell_image.ndim == 3 else cell_image
+    _,binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    ink_points = cv2.findNonZero(255 - binary)
+    if ink_points is None: return np.full((2*margin,2*margin), 255, np.uint8)
+    x,y,w,h = cv2.boundingRect(ink_points)
+    return cv2.copyMakeBorder(binary[y:y+h, x:x+w], margin, margin, margin, margin, cv2.BORDER_CONSTANT, value=255)
+
+
+def process_stage_3(horizontal_lines: list, vertical_lines: list, unwarped_base_image: MatLike, unwarped_base_image_larger_contours) -> tuple[list[MatLike],dict]:
+    """Removes the gridlines and crops out the individual cells.
 
+    Returns:
+        tuple[list[MatLike],dict]: cell images (in order of the table, row by row), debug images (callables, see output.persist_debugging_images)
+    """
+    cell_coords = get_cell_coordinates(horizontal_lines,vertical_lines)
+    gridless_image = try_to_remove_gridlines(unwarped_base_image, unwarped_base_image_larger_contours)
+    cell_images = get_cells_by_cropping(cell_coords, gridless_image)
+    debug_images = {
+        '13_gridless_image': lambda: gridless_image,
+        '14_cells': lambda: cell_images,
+    }
+    return cell_images, debug_images
@@ -0,0 +1,48 @@
+import json
+import os
+
+import config
+
+
+class Manifest:
+    """Record of the documents already processed, used for incremental runs.
+    Stored as a JSON file mapping each link href to its link name, the sha256 of its PDF, the pipeline version it was processed with and its output path.
+
+    Args:
+        path (str): path of the JSON file. It is created on the first save if it doesn't exist.
+    """
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, 'rt') as f: self.entries = json.load(f)
+
+    def up_to_date_hrefs(self) -> set[str]:
+        """hrefs of all the documents that wouldn't need processing again."""
+        return {href for href in self.entries if self.is_up_to_date(href)}
+
+    def is_up_to_date(self, href: str, content_hash: str = None) -> bool:
+        """True if the document was processed with the current pipeline version and its output still exists.
+        If content_hash is given, the PDF must also not have changed since."""
+        entry = self.entries.get(href)
+        if entry is None: return False
+        if entry['pipeline_version'] != config.pipeline_version: return False
+        if content_hash is not None and entry['content_hash'] != content_hash: return False
+        return os.path.exists(entry['output_path'])
+
+    def record(self, name: str, href: str, content_hash: str, output_path: str):
+        """Records a successfully processed document and saves the manifest straight away, so an interrupted run loses nothing."""
+        self.entries[href] = {
+            'name': name,
+            'href': href,
+            'content_hash': content_hash,
+            'pipeline_version': config.pipeline_version,
+            'output_path': output_path,
+        }
+        self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'wt') as f: json.dump(self.entries, f, indent=1)
+        os.replace(temp_path, self.path)
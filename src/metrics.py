@@ -0,0 +1,144 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource # not available on Windows
+except ImportError:
+    resource = None
+
+
+class DocumentMetrics:
+    """Metrics of one document: wall and CPU time of each stage, counters (contours, cells, tesseract calls...) and peak RSS.
+    CPU time is the CPU time of this process (all its threads), so it doesn't include tesseract subprocesses.
+
+    Args:
+        name (str): link name of the document
+    """
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.ok = None
+        self.wall_seconds = {}
+        self.cpu_seconds = {}
+        self.counts = {}
+        self.peak_rss_bytes = None
+
+    @contextmanager
+    def stage(self, stage: str):
+        """Adds the wall and CPU time taken by the code inside the with block to the stage (a stage can be timed several times)."""
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - wall_start, time.process_time() - cpu_start)
+
+    def add_time(self, stage: str, wall_seconds: float, cpu_seconds: float = None):
+        self.wall_seconds[stage] = self.wall_seconds.get(stage, 0.0) + wall_seconds
+        if cpu_seconds is not None: self.cpu_seconds[stage] = self.cpu_seconds.get(stage, 0.0) + cpu_seconds
+
+    def count(self, key: str, value: int = 1):
+        self.counts[key] = self.counts.get(key, 0) + value
+
+    def record_peak_rss(self):
+        """Records the peak RSS of this process so far."""
+        self.peak_rss_bytes = get_peak_rss_bytes()
+
+    def to_dict(self) -> dict:
+        return {
+            'name': self.name,
+            'ok': self.ok,
+            'wall_seconds': self.wall_seconds,
+            'cpu_seconds': self.cpu_seconds,
+            'counts': self.counts,
+            'peak_rss_bytes': self.peak_rss_bytes,
+        }
+
+
+@contextmanager
+def stage(document_metrics: DocumentMetrics, stage: str):
+    """DocumentMetrics.stage, or nothing if document_metrics is None. For code that can be called with or without metrics."""
+    if document_metrics is None:
+        yield
+        return
+    with document_metrics.stage(stage):
+        yield
+
+
+def get_peak_rss_bytes() -> int:
+    """Peak resident set size of this process, or None where it isn't available (Windows)."""
+    if resource is None: return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if os.uname().sysname == 'Darwin': return max_rss # bytes on macOS
+    return max_rss * 1024 # kilobytes on Linux
+
+
+def write_jsonl(all_metrics: list[DocumentMetrics], path: str):
+    """Appends the metrics of each document to the JSON lines file (one line per document), tagged with the time of the run."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    run = datetime.now().isoformat(timespec='seconds')
+    with open(path, 'at') as f:
+        for document_metrics in all_metrics:
+            f.write(json.dumps({'run': run, **document_metrics.to_dict()}) + '\n')
+
+
+def write_prometheus_textfile(all_metrics: list[DocumentMetrics], path: str, wall_seconds: float):
+    """Writes the totals of the run in the Prometheus text format (eg: for the node_exporter textfile collector)."""
+    lines = []
+    def metric(metric_name: str, metric_type: str, help_text: str, samples: list[tuple[str,float]]):
+        lines.append(f'# HELP {metric_name} {help_text}')
+        lines.append(f'# TYPE {metric_name} {metric_type}')
+        for labels,value in samples: lines.append(f'{metric_name}{labels} {value}')
+
+    ok_count = sum(1 for document_metrics in all_metrics if document_metrics.ok)
+    metric('exrates_documents', 'gauge', 'Documents processed in the last run.',
+           [('{status="ok"}', ok_count), ('{status="nok"}', len(all_metrics) - ok_count)])
+    metric('exrates_run_seconds', 'gauge', 'Wall time of the last run.', [('', round(wall_seconds, 3))])
+    stages = __ordered_keys([document_metrics.wall_seconds for document_metrics in all_metrics])
+    metric('exrates_stage_wall_seconds', 'gauge', 'Total wall time of each stage in the last run.',
+           [(f'{{stage="{stage}"}}', round(sum(m.wall_seconds.get(stage, 0.0) for m in all_metrics), 3)) for stage in stages])
+    metric('exrates_stage_cpu_seconds', 'gauge', 'Total CPU time of each stage in the last run.',
+           [(f'{{stage="{stage}"}}', round(sum(m.cpu_seconds.get(stage, 0.0) for m in all_metrics), 3)) for stage in stages])
+    counts = __ordered_keys([document_metrics.counts for document_metrics in all_metrics])
+    metric('exrates_count', 'gauge', 'Totals of the counters (contours, cells, tesseract calls...) in the last run.',
+           [(f'{{counter="{key}"}}', sum(m.counts.get(key, 0) for m in all_metrics)) for key in counts])
+    peak_rss = [document_metrics.peak_rss_bytes for document_metrics in all_metrics if document_metrics.peak_rss_bytes is not None]
+    if peak_rss: metric('exrates_peak_rss_bytes', 'gauge', 'Highest peak RSS of the processes in the last run.', [('', max(peak_rss))])
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wt') as f: f.write('\n'.join(lines) + '\n')
+    os.replace(temp_path, path) # the collector must never read half a file
+
+
+def print_timing_summary(all_metrics: list[DocumentMetrics], wall_seconds: float):
+    """Prints the total and mean time taken by each stage across all documents, and the overall throughput.
+
+    Args:
+        all_metrics (list[DocumentMetrics]): the metrics of each document
+        wall_seconds (float): wall time of the whole run
+    """
+    stages = __ordered_keys([document_metrics.wall_seconds for document_metrics in all_metrics])
+
+    print('STAGE TIMINGS (seconds)')
+    print(f'{"stage":<24}{"docs":>6}{"total":>10}{"mean":>10}{"max":>10}{"cpu":>10}')
+    for stage in stages:
+        values = [m.wall_seconds[stage] for m in all_metrics if stage in m.wall_seconds]
+        cpu = sum(m.cpu_seconds.get(stage, 0.0) for m in all_metrics)
+        print(f'{stage:<24}{len(values):>6}{sum(values):>10.2f}{sum(values)/len(values):>10.2f}{max(values):>10.2f}{cpu:>10.2f}')
+    for key in __ordered_keys([document_metrics.counts for document_metrics in all_metrics]):
+        print(f'{key}: {sum(m.counts.get(key, 0) for m in all_metrics)}')
+    peak_rss = [document_metrics.peak_rss_bytes for document_metrics in all_metrics if document_metrics.peak_rss_bytes is not None]
+    if peak_rss: print(f'peak RSS: {max(peak_rss)/1024**2:.0f} MiB')
+    if wall_seconds > 0:
+        print(f'{len(all_metrics)} documents in {wall_seconds:.1f}s ({len(all_metrics)/wall_seconds:.2f} docs/s)')
+
+
+def __ordered_keys(dicts: list[dict]) -> list:
+    """Keys of all the dicts, in order of first appearance."""
+    keys = {}
+    for dictionary in dicts:
+        for key in dictionary: keys[key] = None
+    return list(keys)
@@ -0,0 +1,109 @@
+import math
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import cv2
+from cv2.typing import MatLike
+
+import config
+
+
+_ocr_cache = None
+_ocr_cache_lock = threading.Lock()
+
+# fingerprints are the cell's ink scaled to this many pixels, 1 bit each
+FINGERPRINT_WIDTH = 64
+FINGERPRINT_HEIGHT = 16
+
+
+class OcrCache:
+    """Cache of OCR results, keyed by a fingerprint of the cell image, so that cells seen before are not OCR'd again.
+    A cell matches a cached one only if their fingerprints are identical and the aspect ratios of their ink are within 10% -
+    near matches are not used, as cells with different text can be closer than 2 scans of the same text (eg: Krone and Krona).
+    So hits are mostly cells read again from the same scan (eg: a PDF processed again after a change to the pipeline).
+    Entries are stored in SQLite (persisting across runs), separately for each namespace (eg: a column of the table),
+    and the least recently used ones are evicted once there are more than max_entries.
+    Safe to use from several threads and processes at once.
+
+    Args:
+        path (str): SQLite file to keep the cache in
+        max_entries (int): maximum number of entries across all namespaces
+    """
+    def __init__(self, path: str, max_entries: int) -> None:
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._connection:
+            self._connection.execute('CREATE TABLE IF NOT EXISTS entries (id INTEGER PRIMARY KEY, namespace TEXT NOT NULL, fingerprint BLOB NOT NULL, aspect REAL NOT NULL, text TEXT NOT NULL, last_access REAL NOT NULL)')
+            self._connection.execute('DROP INDEX IF EXISTS entries_namespace')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS entries_fingerprint ON entries (namespace, fingerprint)')
+
+    def get(self, namespace: str, fingerprints: list[tuple[np.ndarray,float]]) -> list[str]:
+        """Returns the cached text of each fingerprint (see get_fingerprint), or None for the ones that aren't cached."""
+        results = []
+        hit_ids = []
+        with self._lock:
+            for fingerprint,aspect in fingerprints:
+                if fingerprint is None:
+                    results.append(None)
+                    continue
+                rows = self._connection.execute('SELECT id, aspect, text FROM entries WHERE namespace = ? AND fingerprint = ? ORDER BY id DESC',
+                                                (namespace, fingerprint.tobytes())).fetchall()
+                match = next((row for row in rows if abs(math.log(row[1] / aspect)) <= math.log(1.1)), None)
+                results.append(match[2] if match is not None else None)
+                if match is not None: hit_ids.append(match[0])
+            if hit_ids:
+                with self._connection:
+                    self._connection.executemany('UPDATE entries SET last_access = ? WHERE id = ?', [(time.time(), id) for id in hit_ids])
+        return results
+
+    def put(self, namespace: str, fingerprints: list[tuple[np.ndarray,float]], texts: list[str]):
+        """Stores the OCR'd text of each fingerprint, then evicts least recently used entries if there are too many."""
+        rows = [(namespace, fingerprint.tobytes(), aspect, text, time.time()) for (fingerprint,aspect),text in zip(fingerprints,texts) if fingerprint is not None]
+        if len(rows) == 0: return
+        with self._lock:
+            with self._connection:
+                self._connection.executemany('INSERT INTO entries (namespace, fingerprint, aspect, text, last_access) VALUES (?, ?, ?, ?, ?)', rows)
+            self.__evict()
+
+    def __evict(self):
+        entry_count = self._connection.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        if entry_count <= self.max_entries: return
+        with self._connection:
+            self._connection.execute('DELETE FROM entries WHERE id IN (SELECT id FROM entries ORDER BY last_access LIMIT ?)', (entry_count - self.max_entries,))
+
+
+def get_fingerprint(cell_image: MatLike) -> tuple[np.ndarray,float]:
+    """Fingerprint of a cell image for the OCR cache: the cell is binarized (Otsu), cropped to the bounding box of its ink,
+    slightly blurred and scaled to FINGERPRINT_WIDTH x FINGERPRINT_HEIGHT, 1 bit per pixel - so the position of the text in the cell
+    and its size don't matter. The aspect ratio of the ink is returned too, as the scaling loses it.
+
+    Args:
+        cell_image (MatLike): cell image (BGR or grayscale)
+
+    Returns:
+        tuple[np.ndarray,float]: the packed bits of the fingerprint and the aspect ratio (width/height) of the ink. (None, None) if the cell has no ink.
+    """
+    if cell_image.size == 0: return None, None
+    gray = cv2.cvtColor(cell_image, cv2.COLOR_BGR2GRAY) if cell_image.ndim == 3 else cell_image
+    _,ink = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)
+    ink_points = cv2.findNonZero(ink)
+    if ink_points is None: return None, None
+    x,y,w,h = cv2.boundingRect(ink_points)
+    ink = ink[y:y+h, x:x+w]
+    ink = cv2.GaussianBlur(ink, (0,0), max(w/FINGERPRINT_WIDTH, h/FINGERPRINT_HEIGHT)/2)
+    small = cv2.resize(ink, (FINGERPRINT_WIDTH,FINGERPRINT_HEIGHT), interpolation=cv2.INTER_AREA)
+    return np.packbits(small >= 128), w/h
+
+
+def get_ocr_cache() -> OcrCache:
+    """Returns the OCR cache of this process (created on first use), or None if it is turned off (config.use_cache or config.use_ocr_cache)."""
+    global _ocr_cache
+    if not config.use_cache or not config.use_ocr_cache: return None
+    with _ocr_cache_lock:
+        if _ocr_cache is None: _ocr_cache = OcrCache(os.path.join(config.cache_directory, 'ocr.sqlite'), config.ocr_cache_max_entries)
+    return _ocr_cache
@@ -1,22 +1,42 @@
-from io import BytesIO
 import src.tesseract_interface as tesseract_interface
-import cv2
+from src import debug_writer
+from src import metrics
+from src import image_processing_stage_3
+from src import ocr_cache
 from cv2.typing import MatLike
-from src import image_processing_stage_1
 import re
-import io
+from string import ascii_uppercase
 import config
 import os
 
 
-def cell_images_to_csvstring(cell_images: list[MatLike]) -> str:
-    """Performs the OCR process on the list of cell images, and collects the detected text into a csv string.
+# the columns of the output, in order
+COLUMNS = ('country', 'country_code', 'currency', 'currency_code', 'er')
+
+# tesseract variables for the cells of each column (config.use_ocr_profiles)
+__NO_DICTIONARY = {'load_system_dawg': '0', 'load_freq_dawg': '0'}
+__OCR_WORDS_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ocr_words')
+OCR_PROFILES = {
+    'country': {'user_words_file': os.path.join(__OCR_WORDS_DIRECTORY, 'countries.txt')},
+    'country_code': {'tessedit_char_whitelist': ascii_uppercase, **__NO_DICTIONARY},
+    'currency': {'user_words_file': os.path.join(__OCR_WORDS_DIRECTORY, 'currencies.txt')},
+    'currency_code': {'tessedit_char_whitelist': ascii_uppercase, **__NO_DICTIONARY},
+    'er': {'tessedit_char_whitelist': '0123456789.', **__NO_DICTIONARY},
+}
+
+def get_csv_path(name: str) -> str:
+    """Path of the output csv file of the document with the given link name."""
+    return os.path.join('output', f'{name}.csv')
+
+def cell_images_to_rows(cell_images: list[MatLike], document_metrics: metrics.DocumentMetrics = None) -> list[tuple[str,str,str,str,str]]:
+    """Performs the OCR process on the list of cell images, and collects the detected text into the rows of the table.
 
     Args:
         cell_images (list[MatLike]): list of cell images (in order of the table)
+        document_metrics (metrics.DocumentMetrics, optional): if given, the OCR of each column is timed as its own stage (ocr_<column>). Defaults to None.
 
     Returns:
-        str: csv string of the table represented by the list of cell images
+        list[tuple[str,str,str,str,str]]: rows of the table represented by the list of cell images (country, country code, currency, currency code, exchange rate)
     """
 
     # separate the cell images by column heading
@@ -43,103 +63,113 @@ def cell_images_to_csvstring(cell_images: list[MatLike]) -> str:
             er.append(cell_image)
             col_counter = -1
 
-    # lists for holding the ocr results
-    country_ocr = []
-    country_code_ocr = []
-    currency_ocr = []
-    currency_code_ocr = []
-    er_ocr = []
-
-    # for each type of cell (belonging to a certain column), apply OCR and column-specific regex
-    for cell in country:
-        string = tesseract_interface.get_ocr_of_image(cell, '7')
-        string = string.strip()
-        string = re.sub('^[^a-zA-Z0-9.()]+|[^a-zA-Z0-9.()]+$', '', string) # OCR is likely to falsely detect special characters at the start and end of text
-        string = string.strip()
-        string = string.replace(',','') # commas anywhere in the text must be removed because we are using .csv
-        country_ocr.append(string)
+    # OCR each column as one batch, then apply column-specific regex
+    country_ocr = [clean_cell_text('country',string) for string in __ocr_column(country,'country',document_metrics)]
+    er_ocr = [clean_cell_text('er',string) for string in __ocr_column(er,'er',document_metrics)]
+    currency_code_ocr = [clean_cell_text('currency_code',string) for string in __ocr_column(currency_code,'currency_code',document_metrics)]
+    country_code_ocr = [clean_cell_text('country_code',string) for string in __ocr_column(country_code,'country_code',document_metrics)]
+    currency_ocr = [clean_cell_text('currency',string) for string in __ocr_column(currency,'currency',document_metrics)]
 
-    for cell in er:
-        string = tesseract_interface.get_ocr_of_image(cell, '7')
-        string = string.strip()
-        string = re.sub('^[^0-9]+|[^0-9]+$', '', string) # OCR is likely to falsely detect special characters at the start and end of text
-        string = string.replace(' ', '') # exchange rates don't have spaces
-        string = string.strip()     
-        string = string.replace(',','') # commas anywhere in the text must be removed because we are using .csv
-        er_ocr.append(string)
+    # collect all into rows
+    return list(zip(country_ocr,country_code_ocr,currency_ocr,currency_code_ocr,er_ocr))
 
-    for cell in currency_code:
-        string = tesseract_interface.get_ocr_of_image(cell, '7')
-        string = string.strip()
-        string = re.sub('^[^A-Z]+|[^A-Z]+$', '', string) # OCR is likely to falsely detect special characters at the start and end of text
-        string = string.strip()
-        string = string.replace(',','') # commas anywhere in the text must be removed because we are using .csv
-        currency_code_ocr.append(string)
+def text_table_to_rows(table: list[list[str]]) -> list[tuple[str,str,str,str,str]]:
+    """Collects the rows of the table from the text of its cells (eg: read from the PDF's text layer - see pdf_text_table), cleaned up like OCR'd text.
+    As with the cell images, the first column is skipped and the next 5 are the country, country code, currency, currency code and exchange rate.
 
-    for cell in country_code:
-        string = tesseract_interface.get_ocr_of_image(cell, '7')
-        string = string.strip()
-        string = re.sub('^[^A-Z]+|[^A-Z]+$', '', string) # OCR is likely to falsely detect special characters at the start and end of text
-        string = string.strip()
-        string = string.replace(',','') # commas anywhere in the text must be removed because we are using .csv
-        country_code_ocr.append(string)
+    Args:
+        table (list[list[str]]): text of each cell (None for empty cells) of each row
 
-    for cell in currency:
-        string = tesseract_interface.get_ocr_of_image(cell, '7')
-        string = string.strip()
+    Returns:
+        list[tuple[str,str,str,str,str]]: rows of the table (country, country code, currency, currency code, exchange rate)
+    """
+    rows = []
+    for cells in table:
+        texts = [' '.join((cell or '').split()) for cell in cells[1:6]] # text wrapped over several lines in a cell becomes one line
+        texts += [''] * (5 - len(texts))
+        rows.append(tuple(clean_cell_text(column,text) for column,text in zip(COLUMNS,texts)))
+    return rows
+
+def clean_cell_text(column: str, string: str) -> str:
+    """Cleans up the text of a cell of the given column (one of COLUMNS), whether it was OCR'd or read from the PDF's text layer."""
+    string = string.strip()
+    if column == 'er':
+        string = re.sub('^[^0-9]+|[^0-9]+$', '', string) # OCR is likely to falsely detect special characters at the start and end of text
+        string = string.replace(' ', '') # exchange rates don't have spaces
+    elif column in ('country_code','currency_code'):
+        string = re.sub('^[^A-Z]+|[^A-Z]+$', '', string) # OCR is likely to falsely detect special characters at the start and end of text
+    else:
         string = re.sub('^[^a-zA-Z0-9.()]+|[^a-zA-Z0-9.()]+$', '', string) # OCR is likely to falsely detect special characters at the start and end of text
-        string = string.strip()
-        string = string.replace(',','') # commas anywhere in the text must be removed because we are using .csv
-        currency_ocr.append(string)
-
-    # collect all into a csv string
-    csv_string = ''
-    for i in range(0,len(country_ocr)):
-        csv_string += f'{country_ocr[i]},{country_code_ocr[i]},{currency_ocr[i]},{currency_code_ocr[i]},{er_ocr[i]}\n'
-
-    return csv_string
-
-def persist_debugging_images_part0(name: str, base_image: MatLike):
-    cv2.imwrite(f'images_for_debugging_and_analysis/1_base_image/{name}.png',base_image)
-
-def persist_debugging_images_part1(name: str, unwarped_base_image: MatLike,image_with_all_contours: MatLike,
-                                   image_with_larger_contours: MatLike,larger_contours_mask_image: MatLike,
-                                   retr_external_img: MatLike,table_corners: tuple):
-    cv2.imwrite(f'images_for_debugging_and_analysis/7_unwarped_base_image/{name}.png',unwarped_base_image)
-    cv2.imwrite(f'images_for_debugging_and_analysis/2_image_with_all_contours/{name}.png',image_with_all_contours)
-    cv2.imwrite(f'images_for_debugging_and_analysis/3_image_with_larger_contours/{name}.png',image_with_larger_contours)
-    cv2.imwrite(f'images_for_debugging_and_analysis/4_larger_contours_mask_image/{name}.png',larger_contours_mask_image)
-    cv2.imwrite(f'images_for_debugging_and_analysis/5_retr_external_img/{name}.png',retr_external_img)
-
-    top_left,top_right,bottom_right,bottom_left = table_corners
-
-    table_corner_image = unwarped_base_image.copy()
-    cv2.circle(table_corner_image,top_left,5,(0,0,255),-1)
-    cv2.circle(table_corner_image,top_right,5,(0,0,255),-1)
-    cv2.circle(table_corner_image,bottom_right,5,(0,0,255),-1)
-    cv2.circle(table_corner_image,bottom_left,5,(0,0,255),-1)
-    cv2.imwrite(f'images_for_debugging_and_analysis/6_table_corner_image/{name}.png',table_corner_image)
-
-
-def persist_debugging_images_part2(name: str, unwarped_base_image: MatLike,vertical_lines: list,horizontal_lines: list,
-                                   plot_for_columns: BytesIO,plot_for_rows: BytesIO,
-                                   unwarped_base_image_with_larger_contours: MatLike,unwarped_base_image_with_all_contours: MatLike):
-    cv2.imwrite(f'images_for_debugging_and_analysis/8_unwarped_base_image_with_all_contours/{name}.png',unwarped_base_image_with_all_contours)
-    cv2.imwrite(f'images_for_debugging_and_analysis/9_unwarped_base_image_with_larger_contours/{name}.png',unwarped_base_image_with_larger_contours)
-
-    with open(f'images_for_debugging_and_analysis/10_plot_for_rows/{name}.png','wb') as f: f.write(plot_for_rows.getvalue())
-    with open(f'images_for_debugging_and_analysis/11_plot_for_columns/{name}.png','wb') as f: f.write(plot_for_columns.getvalue()) 
-
-    image_with_final_grid = unwarped_base_image.copy()
-    for line in horizontal_lines:
-        cv2.line(image_with_final_grid, line[0], line[1], (0,0,255), 3)
-    for line in vertical_lines:
-        cv2.line(image_with_final_grid, line[0], line[1], (0,0,255), 3)
-
-    cv2.imwrite(f'images_for_debugging_and_analysis/12_image_with_final_grid/{name}.png',image_with_final_grid)
-
-def persist_debugging_images_part3(name: str, cell_images: list[MatLike], gridless_image: MatLike):
-    cv2.imwrite(f'images_for_debugging_and_analysis/13_gridless_image/{name}.png',gridless_image)
-    os.makedirs(f'images_for_debugging_and_analysis/14_cells/{name}', exist_ok=True)
-    for i,cell_image in enumerate(cell_images):
-        cv2.imwrite(f'images_for_debugging_and_analysis/14_cells/{name}/{i}.png',cell_image)
+    string = string.strip()
+    string = string.replace(',','') # commas anywhere in the text must be removed because we are using .csv
+    return string
+
+def rows_to_csvstring(rows: list[tuple[str,str,str,str,str]]) -> str:
+    """csv string of the rows (the same as the csv files written by write_csv)."""
+    return ''.join(','.join(row) + '\n' for row in rows)
+
+def write_csv(name: str, rows: list[tuple[str,str,str,str,str]]):
+    """Writes the rows to the csv file of the document in the output folder, a row at a time.
+    They are written to a temporary file which then replaces the csv file, so a csv file is never left half written."""
+    csv_path = get_csv_path(name)
+    os.makedirs(os.path.dirname(csv_path), exist_ok=True)
+    temp_path = csv_path + '.tmp'
+    with open(temp_path, 'wt') as f:
+        for row in rows: f.write(','.join(row) + '\n')
+    os.replace(temp_path, csv_path)
+
+def __ocr_column(cells: list[MatLike], column: str, document_metrics: metrics.DocumentMetrics) -> list[str]:
+    """OCRs the cells of one column, either all stitched into one strip (config.ocr_mode = 'column') or cell by cell through the OCR worker pool.
+    With config.skip_blank_cells, blank cells get an empty string without being OCR'd (counted as blank_cells_skipped).
+    Columns in config.ocr_cache_columns get the text of cells seen before from the OCR cache (counted as ocr_cache_hits), and only the rest are OCR'd.
+    With config.trim_cells_for_ocr, the cells are trimmed to their ink and binarized first, and with config.use_ocr_profiles
+    they are OCR'd with the tesseract variables of the column (OCR_PROFILES)."""
+    with metrics.stage(document_metrics, f'ocr_{column}'):
+        results = [None] * len(cells)
+        if config.skip_blank_cells:
+            for i,cell in enumerate(cells):
+                if image_processing_stage_3.is_blank_cell(cell): results[i] = ''
+        if document_metrics is not None: document_metrics.count('blank_cells_skipped', results.count(''))
+
+        cache = ocr_cache.get_ocr_cache() if column in config.ocr_cache_columns else None
+        if cache is not None:
+            indexes = [i for i,result in enumerate(results) if result is None]
+            fingerprints = {i: ocr_cache.get_fingerprint(cells[i]) for i in indexes}
+            namespace = __get_ocr_cache_namespace(column)
+            cached_strings = cache.get(namespace, [fingerprints[i] for i in indexes])
+            for i,string in zip(indexes, cached_strings): results[i] = string
+            if document_metrics is not None: document_metrics.count('ocr_cache_hits', sum(1 for string in cached_strings if string is not None))
+
+        indexes = [i for i,result in enumerate(results) if result is None]
+        cells_to_ocr = [cells[i] for i in indexes]
+        if config.trim_cells_for_ocr: cells_to_ocr = [image_processing_stage_3.trim_and_binarize_cell(cell) for cell in cells_to_ocr]
+        variables = OCR_PROFILES.get(column) if config.use_ocr_profiles else None
+        if config.ocr_mode == 'column': strings = tesseract_interface.get_ocr_of_column_strip(cells_to_ocr, variables=variables)
+        else: strings = tesseract_interface.get_ocr_of_images(cells_to_ocr, '7', variables)
+        for i,string in zip(indexes, strings): results[i] = string
+
+        if cache is not None: cache.put(namespace, [fingerprints[i] for i in indexes], strings)
+        return results
+
+def __get_ocr_cache_namespace(column: str) -> str:
+    """OCR cache namespace of the column. It includes the settings that change the OCR results, so results are only reused under the same settings."""
+    return f'{column}:mode={config.ocr_mode}:profiles={config.use_ocr_profiles}:trim={config.trim_cells_for_ocr}'
+
+# debug images written with config.debug_level = 'summary'. 'full' writes all of them.
+SUMMARY_DEBUG_IMAGES = ('1_base_image','6_table_corner_image','12_image_with_final_grid','13_gridless_image')
+
+def persist_debugging_images(name: str, debug_images: dict):
+    """Queues the debug images wanted by config.debug_level ('off', 'summary' or 'full') to be written to their folders in images_for_debugging_and_analysis
+    by the background debug image writer (see debug_writer). The cells are written to one zip per document.
+    The debug images are callables (as returned by the processing stages), and only the ones that are written are ever called, so with
+    debug_level 'off' no debug image is even drawn.
+
+    Args:
+        name (str): link name of the document, used as the file name
+        debug_images (dict): debug image folder name -> callable returning the image (a MatLike, a BytesIO of a png, or for 14_cells a list of MatLikes)
+    """
+    if config.debug_level == 'off': return
+    writer = debug_writer.get_debug_writer()
+    for folder,get_image in debug_images.items():
+        if config.debug_level == 'summary' and folder not in SUMMARY_DEBUG_IMAGES: continue
+        writer.submit(name,folder,get_image)
@@ -0,0 +1,58 @@
+import hashlib
+import json
+import re
+from io import BytesIO
+
+import fitz # this is pymupdf
+
+from src import get_table_image
+from src.cache import Cache
+
+
+# fewer words than this on the target page means it has no real text layer (eg: a scan with a stamp or a page number on it)
+MIN_WORDS = 20
+# the table has a row number column, then country, country code, currency, currency code and exchange rate
+MIN_COLUMNS = 6
+
+
+def get_table_from_text_layer(pdf_bytesio: BytesIO, cache: Cache = None) -> list[list[str]]:
+    """Reads the table straight from the text layer of the target page of the PDF (see get_table_image.get_target_page),
+    for PDFs made from a spreadsheet or document rather than a scan - no image processing and no OCR.
+    The table is found with PyMuPDF's find_tables, from the lines drawn around its cells and the positions of the words.
+    If several are found, the one with the most rows is taken.
+    If a cache is given, the result (the table, or that there is none) is cached by the sha256 of the PDF, so the same PDF is only ever searched once.
+
+    Args:
+        pdf_bytesio (io.BytesIO): PDF as BytesIO
+        cache (Cache, optional): cache to read the result from and store it in. Defaults to None (no caching).
+
+    Returns:
+        list[list[str]]: text of each cell (None for empty cells) of each row - see output.text_table_to_rows.
+        None if the page has no text layer or no table with enough columns and exchange rates in it, so the table has to be read from its image.
+    """
+    if cache is not None:
+        cache_key = f'text_table:{hashlib.sha256(pdf_bytesio.getvalue()).hexdigest()}'
+        cached = cache.get(cache_key)
+        if cached is not None: return json.loads(cached[0]) # null if the PDF has no usable text layer
+        rows = get_table_from_text_layer(pdf_bytesio)
+        cache.put(cache_key, json.dumps(rows).encode())
+        return rows
+
+    try:
+        fitz_file = fitz.open("pdf", pdf_bytesio)
+        page = get_table_image.get_target_page(fitz_file)
+    except Exception:
+        return None # not readable or no pages - left to get_table_image to report
+    if len(page.get_text('words')) < MIN_WORDS: return None
+
+    tables = [table for table in page.find_tables().tables if table.col_count >= MIN_COLUMNS]
+    if len(tables) == 0: return None
+    rows = max(tables, key=lambda table: table.row_count).extract()
+
+    # a scan with an OCR'd text layer could have other tables - make sure this one has exchange rates in it
+    if not any(__is_number(row[5]) for row in rows): return None
+    return rows
+
+
+def __is_number(text: str) -> bool:
+    return text is not None and re.fullmatch(r'\s*\d[\d,]*(\.\d+)?\s*', text) is not None
@@ -0,0 +1,103 @@
+from io import BytesIO
+
+from cv2.typing import MatLike
+
+from src import tesseract_interface
+from src import get_table_image
+from src import pdf_text_table
+from src import image_processing
+from src import image_processing_stage_1
+from src import image_processing_stage_2
+from src import image_processing_stage_3
+from src import output
+from src import metrics
+from src import cache
+import config
+
+
+def process_pdf(name: str, pdf_bytesio: BytesIO, document_metrics: metrics.DocumentMetrics) -> list[tuple[str,str,str,str,str]]:
+    """Runs the whole pipeline for one (already downloaded) document, returning the rows of its table.
+    If the PDF has the table in its text layer, it is read from there, otherwise from the image of the table.
+    The time taken by each stage and some counts are recorded in document_metrics.
+
+    Args:
+        name (str): link name of the document (used for the debug image file names)
+        pdf_bytesio (BytesIO): the PDF
+        document_metrics (metrics.DocumentMetrics): metrics of the document
+
+    Raises:
+        get_table_image.TableImageException: if the table image can't be extracted from the PDF
+
+    Returns:
+        list[tuple[str,str,str,str,str]]: rows of the table (see output.cell_images_to_rows)
+    """
+
+    # PDFs with a text layer (not scanned) have their table read straight from the text - no image processing and no OCR
+    if config.use_pdf_text_layer:
+        with document_metrics.stage('text_layer'):
+            table = pdf_text_table.get_table_from_text_layer(pdf_bytesio, cache.get_cache())
+            rows = output.text_table_to_rows(table) if table is not None else None
+        if rows is not None:
+            document_metrics.count('text_layer_documents')
+            document_metrics.count('rows', len(rows))
+            return rows
+
+    # get the table image from PDF
+    with document_metrics.stage('get_table_image'):
+        image_bytes,_,angle  = get_table_image.get_table_image_from_pdfbytesio(pdf_bytesio, cache.get_cache())
+    
+    # convert image to OpenCV matlike, rotated to display correctly. This is our base image.
+    with document_metrics.stage('decode'):
+        base_image = image_processing.rotate_image(image_processing.convert_bytes_to_openCV_matlike(image_bytes), angle)
+    return process_image(name,base_image,document_metrics)
+
+
+def process_image(name: str, base_image: MatLike, document_metrics: metrics.DocumentMetrics) -> list[tuple[str,str,str,str,str]]:
+    """Runs the image processing stages and the OCR on the table image, returning the rows of the table.
+
+    Args:
+        name (str): link name of the document (used for the debug image file names)
+        base_image (MatLike): the table image ripped from the PDF
+        document_metrics (metrics.DocumentMetrics): metrics of the document
+
+    Returns:
+        list[tuple[str,str,str,str,str]]: rows of the table (see output.cell_images_to_rows)
+    """
+    with document_metrics.stage('debug_images'):
+        output.persist_debugging_images(name,{'1_base_image': lambda: base_image})
+
+    # perform 1st stage of processing, mainly to get the image of just the table - cropped and perspective transformed to compensate for scanner/photograph angle
+    with document_metrics.stage('stage_1'):
+        unwarped_base_image,table_corners,M,larger_contours_of_base_image,debug_images = image_processing_stage_1.process_stage_1(base_image)
+    with document_metrics.stage('debug_images'):
+        output.persist_debugging_images(name,debug_images)
+
+    # 2nd stage of processing - identifying the row and column gridlines from the unwarped base image
+    with document_metrics.stage('stage_2'):
+        # stage 1's larger contours can be reused, unless the unwarping changed the table too much for them to still match the image
+        reused_larger_contours = None
+        image_height,image_width = base_image.shape[:2]
+        if config.reuse_stage_1_contours and image_processing_stage_1.get_warp_distortion(table_corners,image_width,image_height) <= config.max_warp_distortion_for_contour_reuse:
+            reused_larger_contours = image_processing.transform_contours(larger_contours_of_base_image,M,image_width,image_height)
+            document_metrics.count('stage_1_contours_reused')
+        vertical_lines,horizontal_lines,larger_contours_of_unwarped_base_image,debug_images = image_processing_stage_2.process_stage_2(unwarped_base_image,reused_larger_contours)
+    del larger_contours_of_base_image
+    document_metrics.count('larger_contours', len(larger_contours_of_unwarped_base_image))
+    document_metrics.count('rows', len(horizontal_lines)-1)
+    document_metrics.count('columns', len(vertical_lines)-1)
+    with document_metrics.stage('debug_images'):
+        output.persist_debugging_images(name,debug_images)
+
+    # 3rd stage - extract and get a list of individual cell images
+    with document_metrics.stage('stage_3'):
+        cell_images,debug_images = image_processing_stage_3.process_stage_3(horizontal_lines,vertical_lines,unwarped_base_image,larger_contours_of_unwarped_base_image)
+    document_metrics.count('cells', len(cell_images))
+    with document_metrics.stage('debug_images'):
+        output.persist_debugging_images(name,debug_images)
+    del debug_images # the debug image callables keep intermediate images alive (until the debug image writer has called them)
+
+    tesseract_calls_before = tesseract_interface.get_call_count()
+    with document_metrics.stage('ocr'):
+        rows = output.cell_images_to_rows(cell_images, document_metrics)
+    document_metrics.count('tesseract_calls', tesseract_interface.get_call_count() - tesseract_calls_before)
+    return rows
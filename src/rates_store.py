@@ -0,0 +1,77 @@
+import os
+import re
+import sqlite3
+import threading
+from datetime import date
+
+import config
+
+
+_rates_store = None
+_rates_store_lock = threading.Lock()
+
+MONTHS = {month: i+1 for i,month in enumerate(['jan','feb','mar','apr','may','jun','jul','aug','sep','oct','nov','dec'])}
+
+
+class RatesStore:
+    """All the exchange rates of all the documents in one SQLite database, so they can be queried (eg: the rate of a currency
+    over the years) without opening hundreds of csv files. Rows are indexed by the date of their document and by currency code.
+    Processing a document again replaces its rows. Safe to use from several threads and processes at once.
+
+    Args:
+        path (str): SQLite file to keep the rates in
+    """
+    def __init__(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._connection:
+            self._connection.execute('PRAGMA journal_mode=WAL') # readers don't block the writer (eg: while the run is going)
+            self._connection.execute('CREATE TABLE IF NOT EXISTS rates (document TEXT NOT NULL, date TEXT, row INTEGER NOT NULL, country TEXT, country_code TEXT, currency TEXT, currency_code TEXT, rate REAL, rate_text TEXT, PRIMARY KEY (document, row))')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS rates_date ON rates (date)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS rates_currency_code ON rates (currency_code, date)')
+
+    def write_document(self, name: str, rows: list[tuple[str,str,str,str,str]]):
+        """Replaces the rows of the document with these rows (as in the csv: country, country code, currency, currency code, exchange rate).
+        The date is parsed from the document name (None if it can't be), and rates that aren't numbers are stored as NULL (their text is kept in rate_text)."""
+        document_date = parse_date_from_name(name)
+        records = [(name, document_date, i, country, country_code, currency, currency_code, self.__to_float(rate), rate)
+                   for i,(country,country_code,currency,currency_code,rate) in enumerate(rows)]
+        with self._lock:
+            with self._connection:
+                self._connection.execute('DELETE FROM rates WHERE document = ?', (name,))
+                self._connection.executemany('INSERT INTO rates VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', records)
+
+    @staticmethod
+    def __to_float(value: str) -> float:
+        try: return float(value)
+        except ValueError: return None
+
+
+def parse_date_from_name(name: str) -> str:
+    """Date (ISO format, eg: 2024-05-06) in a document's link name, or None if there isn't one.
+    Understands year first (2024-05-06, 2024.05.06, 2024/05/06), day first (06-05-2024, 06.05.2024, 06/05/2024)
+    and month names (6th May 2024, 6th of May 2024, May 6, 2024, 06-May-2024)."""
+    year_first = re.search(r'(\d{4})[-./](\d{1,2})[-./](\d{1,2})', name)
+    if year_first: return __iso_date(year_first[1], year_first[2], year_first[3])
+    day_first = re.search(r'(\d{1,2})[-./](\d{1,2})[-./](\d{4})', name)
+    if day_first: return __iso_date(day_first[3], day_first[2], day_first[1])
+    day_month = re.search(r'(\d{1,2})(?:st|nd|rd|th)?[\s\-.,]*(?:of\s+)?([A-Za-z]{3})[A-Za-z]*[\s\-.,]*(\d{4})', name)
+    if day_month and day_month[2].lower() in MONTHS: return __iso_date(day_month[3], MONTHS[day_month[2].lower()], day_month[1])
+    month_day = re.search(r'([A-Za-z]{3})[A-Za-z]*[\s\-.,]*(\d{1,2})(?:st|nd|rd|th)?[\s\-.,]+(\d{4})', name)
+    if month_day and month_day[1].lower() in MONTHS: return __iso_date(month_day[3], MONTHS[month_day[1].lower()], month_day[2])
+    return None
+
+
+def __iso_date(year, month, day) -> str:
+    try: return date(int(year), int(month), int(day)).isoformat()
+    except ValueError: return None
+
+
+def get_rates_store() -> RatesStore:
+    """Returns the rates store of this process (created on first use), or None if it is turned off (config.rates_store_path is None)."""
+    global _rates_store
+    if config.rates_store_path is None: return None
+    with _rates_store_lock:
+        if _rates_store is None: _rates_store = RatesStore(config.rates_store_path)
+    return _rates_store
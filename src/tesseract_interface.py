@@ -1,40 +1,294 @@
+import os
 import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import cv2
 from cv2.typing import MatLike
-from io import BytesIO
 
-def get_ocr_of_image(image: MatLike, psm: str = '3') -> str:
+try:
+    import tesserocr # optional - libtesseract bindings, lets us keep the language data loaded between cells
+except ImportError:
+    tesserocr = None
+
+import config
+
+
+# the pool of warm OCR workers is created on first use and lives for the rest of the process
+_executor = None
+_executor_worker_count = None # the size of the pool when it was made - config.ocr_workers may have changed since
+_executor_lock = threading.Lock()
+_thread_local = threading.local()
+
+# number of times tesseract was invoked (process launches and libtesseract recognitions) in this process, for metrics
+_call_count = 0
+_call_count_lock = threading.Lock()
+
+
+def get_ocr_of_image(image: MatLike, psm: str = '3', variables: dict = None) -> str:
     """Takes image (in the format of opencv matlike) and returns string of recognized text
 
     Args:
         image (matlike): Image (in the format of opencv matlike)
         psm (str, optional): _description_. Defaults to '3' as this is the tesseract default psm.
+        variables (dict, optional): tesseract variables (eg: a tessedit_char_whitelist) - see output.OCR_PROFILES. Defaults to None.
 
     Returns:
         str: Recongnized text
     """
-    image_bytes_io = __convert_matlike_to_bytesIO(image)
-    image_bytes = image_bytes_io.read()
+    __count_call()
+    image_bytes = __encode_for_tesseract(image)
     # result = subprocess.run(['tesseract', 'stdin', 'stdout'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-    process = subprocess.Popen(['tesseract', 'stdin', 'stdout', '--psm', psm], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    process = subprocess.Popen(['tesseract', 'stdin', 'stdout', '--psm', psm] + __get_variable_args(variables), stdin=subprocess.PIPE, stdout=subprocess.PIPE)
     result = process.communicate(input=image_bytes)
     stdout = result[0]
     output = stdout.decode()
     return output
 
 
-def __convert_matlike_to_bytesIO(image: MatLike) -> BytesIO:
-    """Converts a matlike image (typically from OpenCV) to BytesIO for a png image
+def get_ocr_of_images(images: list[MatLike], psm: str = '3', variables: dict = None) -> list[str]:
+    """OCRs a whole batch of images using the pool of warm OCR workers. Results are returned in the same order as the images.
+
+    If tesserocr is installed, each worker thread keeps its own libtesseract instance alive, so the language data is only loaded once per thread.
+    Otherwise the batch is split into one chunk per worker and each chunk is OCR'd by a single tesseract process fed with a file list (batch mode).
 
     Args:
-        image (matlike): matlike image (typically from OpenCV)
+        images (list[MatLike]): images (in the format of opencv matlike)
+        psm (str, optional): Defaults to '3' as this is the tesseract default psm.
+        variables (dict, optional): tesseract variables (eg: a tessedit_char_whitelist) - see output.OCR_PROFILES. Defaults to None.
+
+    Returns:
+        list[str]: recognized text of each image, in the order of the images
+    """
+    if len(images) == 0: return []
+    executor = __get_executor()
+
+    if tesserocr is not None:
+        return list(executor.map(lambda image: __ocr_with_tesserocr(image, psm, variables), images))
+
+    # split into contiguous chunks, so that joining the chunk results keeps the original order
+    worker_count = get_worker_count()
+    chunk_size = -(-len(images) // worker_count) # ceiling division
+    chunks = [images[i:i+chunk_size] for i in range(0, len(images), chunk_size)]
+    results = []
+    for chunk_result in executor.map(lambda chunk: __ocr_with_batch_mode(chunk, psm, variables), chunks):
+        results.extend(chunk_result)
+    return results
+
+
+def get_ocr_of_column_strip(images: list[MatLike], separator_height: int = 40, variables: dict = None) -> list[str]:
+    """OCRs a whole column of cells with a single tesseract call.
+    The cells are stacked vertically (separated by white bands) into one strip, which is OCR'd with psm 6 and TSV output.
+    The word bounding boxes are then mapped back to the rows they fall into.
+    Rows whose mapping is ambiguous (no words found, or a word crossing into a separator band) are OCR'd again per cell with psm 7.
+
+    Args:
+        images (list[MatLike]): cell images of one column, in order of the rows
+        separator_height (int, optional): height of the white band between 2 cells. Defaults to 40.
+        variables (dict, optional): tesseract variables (eg: a tessedit_char_whitelist) - see output.OCR_PROFILES. Defaults to None.
 
     Returns:
-        BytesIO: BytesIO representation of a png image
+        list[str]: recognized text of each cell, in the order of the images
     """
-    _,encoded_image = cv2.imencode('.png', image)
-    image_bytes_io = BytesIO(encoded_image.tobytes())
-    # with open('test.png', 'wb') as file:
-    #     file.write(image_bytes.getvalue())
-    return image_bytes_io
+    if len(images) == 0: return []
+
+    strip, row_ranges = __stack_cells(images, separator_height)
+    words = __parse_tsv_words(__get_tsv_of_image(strip, '6', variables))
+
+    row_words = [[] for _ in images]
+    ambiguous_rows = set()
+    for left,top,width,height,text in words:
+        row_index = __find_row_of_word(row_ranges, top + height/2)
+        if row_index is None: continue # a word in a separator band - noise
+        row_top,row_bottom = row_ranges[row_index]
+        if top < row_top - separator_height/2 or top + height > row_bottom + separator_height/2:
+            ambiguous_rows.add(row_index)
+        row_words[row_index].append(text)
+
+    results = []
+    for i,words_in_row in enumerate(row_words):
+        if len(words_in_row) == 0: ambiguous_rows.add(i)
+        results.append(' '.join(words_in_row))
+
+    # fallback to per-cell OCR
+    ambiguous_rows = sorted(ambiguous_rows)
+    fallback_results = get_ocr_of_images([images[i] for i in ambiguous_rows], '7', variables)
+    for i,string in zip(ambiguous_rows, fallback_results): results[i] = string
+    return results
+
+
+def start_workers(variable_sets: list[dict] = (None,)):
+    """Starts the pool of warm OCR workers now rather than on the first batch (eg: in a long running process, so the first document doesn't wait for them).
+    With tesserocr, every worker also loads the language data (a libtesseract instance for psm 7 and each set of variables).
+
+    Args:
+        variable_sets (list[dict], optional): the sets of tesseract variables the cells will be OCR'd with - see output.OCR_PROFILES. Defaults to (None,) (no variables).
+    """
+    executor = __get_executor()
+    if tesserocr is None: return # batch mode starts a tesseract process per batch, there is nothing to load ahead
+    worker_count = _executor_worker_count # not get_worker_count(): the barrier would wait for threads the pool doesn't have
+    blank = np.full((32,32), 255, np.uint8)
+    barrier = threading.Barrier(worker_count) # makes every worker thread take one of the tasks
+    def warm_up(_):
+        try: barrier.wait(timeout=60)
+        except threading.BrokenBarrierError: pass
+        for variables in variable_sets: __ocr_with_tesserocr(blank, '7', variables)
+    list(executor.map(warm_up, range(worker_count)))
+
+
+def get_call_count() -> int:
+    """Number of times tesseract has been invoked (process launches and libtesseract recognitions) in this process so far."""
+    return _call_count
+
+
+def __count_call():
+    global _call_count
+    with _call_count_lock: _call_count += 1
+
+
+def get_worker_count() -> int:
+    """Number of warm OCR workers. Taken from config.ocr_workers, or the CPU count if that is None."""
+    if config.ocr_workers is not None: return max(1, config.ocr_workers)
+    return os.cpu_count() or 1
+
+
+def __get_executor() -> ThreadPoolExecutor:
+    global _executor, _executor_worker_count
+    with _executor_lock:
+        if _executor is None:
+            _executor_worker_count = get_worker_count()
+            _executor = ThreadPoolExecutor(max_workers=_executor_worker_count, thread_name_prefix='ocr')
+    return _executor
 
+
+def __get_thread_api(psm: str, variables: dict = None):
+    """The libtesseract instance belonging to the current worker thread for this psm and set of variables (created on first use)."""
+    apis = getattr(_thread_local, 'apis', None)
+    if apis is None:
+        apis = _thread_local.apis = {}
+    key = (psm, tuple(sorted((variables or {}).items())))
+    if key not in apis:
+        # some variables (eg: the dictionaries) are only read when tesseract is initialized, so they are all given here
+        apis[key] = tesserocr.PyTessBaseAPI(psm=int(psm), variables=variables or {})
+    return apis[key]
+
+
+def __ocr_with_tesserocr(image: MatLike, psm: str, variables: dict = None) -> str:
+    """OCR using the libtesseract instance belonging to the current worker thread (one instance per psm and set of variables)."""
+    api = __get_thread_api(psm, variables)
+    __count_call()
+    __set_image(api, image)
+    return api.GetUTF8Text()
+
+
+def __tsv_with_tesserocr(image: MatLike, psm: str, variables: dict = None) -> str:
+    """TSV output of the libtesseract instance belonging to the current worker thread - see __ocr_with_tesserocr."""
+    api = __get_thread_api(psm, variables)
+    __set_image(api, image)
+    return api.GetTSVText(0)
+
+
+def __ocr_with_batch_mode(images: list[MatLike], psm: str, variables: dict = None) -> list[str]:
+    """OCR a chunk of images with one tesseract process, by passing it a text file listing the image files.
+    Tesseract ends the text of each image with a form feed, which is how the output is split back up.
+    Falls back to one process per image if the output can't be split cleanly."""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        image_paths = []
+        for i,image in enumerate(images):
+            image_path = os.path.join(temp_dir, f'{i}.pnm')
+            with open(image_path, 'wb') as f: f.write(__encode_for_tesseract(image))
+            image_paths.append(image_path)
+        list_path = os.path.join(temp_dir, 'images.txt')
+        with open(list_path, 'wt') as f: f.write('\n'.join(image_paths) + '\n')
+
+        # each worker is its own process, so stop tesseract from also spinning up threads for every one of them
+        env = dict(os.environ, OMP_THREAD_LIMIT='1')
+        __count_call()
+        result = subprocess.run(['tesseract', list_path, 'stdout', '--psm', psm] + __get_variable_args(variables), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=env)
+
+    outputs = result.stdout.decode().split('\f')[:-1] # text after the last form feed is not an image
+    if len(outputs) != len(images):
+        return [get_ocr_of_image(image, psm, variables) for image in images]
+    return outputs
+
+
+def __get_variable_args(variables: dict) -> list[str]:
+    """Tesseract command line arguments setting the variables (-c name=value)."""
+    args = []
+    for name,value in (variables or {}).items(): args += ['-c', f'{name}={value}']
+    return args
+
+
+def __stack_cells(images: list[MatLike], separator_height: int) -> tuple[MatLike,list[tuple[int,int]]]:
+    """Stacks the cells vertically on a white canvas. Returns the strip and the (top, bottom) y range of each cell in it."""
+    strip_width = max(image.shape[1] for image in images)
+    strip_height = sum(image.shape[0] for image in images) + separator_height*(len(images)+1)
+    channels = images[0].shape[2:] # () for grayscale, (3,) for BGR
+    strip = np.full((strip_height,strip_width) + channels, 255, np.uint8)
+
+    row_ranges = []
+    y = separator_height
+    for image in images:
+        height,width = image.shape[:2]
+        strip[y:y+height, 0:width] = image
+        row_ranges.append((y,y+height))
+        y += height + separator_height
+    return strip, row_ranges
+
+
+def __find_row_of_word(row_ranges: list[tuple[int,int]], y: float):
+    for i,(row_top,row_bottom) in enumerate(row_ranges):
+        if row_top <= y < row_bottom: return i
+    return None
+
+
+def __get_tsv_of_image(image: MatLike, psm: str, variables: dict = None) -> str:
+    __count_call()
+    if tesserocr is not None:
+        # on a worker thread, so the strip gets its warm libtesseract instance instead of loading the language data again
+        return __get_executor().submit(__tsv_with_tesserocr, image, psm, variables).result()
+    image_bytes = __encode_for_tesseract(image)
+    result = subprocess.run(['tesseract', 'stdin', 'stdout', '--psm', psm] + __get_variable_args(variables) + ['tsv'], input=image_bytes, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    return result.stdout.decode()
+
+
+def __parse_tsv_words(tsv: str) -> list[tuple[int,int,int,int,str]]:
+    """Gets (left, top, width, height, text) of every recognized word from tesseract TSV output, in reading order."""
+    words = []
+    for line in tsv.splitlines():
+        fields = line.split('\t')
+        if len(fields) < 12 or fields[0] != '5': continue # level 5 is a word. Also skips the header.
+        text = fields[11].strip()
+        if text == '': continue
+        left,top,width,height = (int(field) for field in fields[6:10])
+        words.append((left,top,width,height,text))
+    return words
+
+
+def __set_image(api, image: MatLike):
+    """Hands the pixels of a matlike image (typically from OpenCV) straight to libtesseract - no encoding and decoding on the way.
+
+    Args:
+        api (tesserocr.PyTessBaseAPI): the libtesseract instance
+        image (matlike): grayscale or BGR image
+    """
+    if image.ndim == 3: image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB) # tesseract expects RGB
+    image = np.ascontiguousarray(image) # cells are views into the page, their rows aren't next to each other
+    height,width = image.shape[:2]
+    bytes_per_pixel = 1 if image.ndim == 2 else image.shape[2]
+    api.SetImageBytes(image.tobytes(), width, height, bytes_per_pixel, width*bytes_per_pixel)
+
+
+def __encode_for_tesseract(image: MatLike) -> bytes:
+    """Encodes a matlike image (typically from OpenCV) for the tesseract command line, as uncompressed PNM (PGM for grayscale, PPM for BGR).
+    PNM is little more than a header in front of the raw pixels, so encoding it (and decoding it in tesseract) costs a fraction of PNG's compression.
+
+    Args:
+        image (matlike): matlike image (typically from OpenCV)
+
+    Returns:
+        bytes: the PNM image
+    """
+    _,encoded_image = cv2.imencode('.pnm', image)
+    return encoded_image.tobytes()
@@ -1,64 +1,326 @@
-from playwright.sync_api import sync_playwright
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import io
+import re
+import subprocess
+import time
+import threading
+import traceback
+from collections import deque
+from collections.abc import Iterator
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+from concurrent.futures import ThreadPoolExecutor
 
-def collect_links(check_older_pages: bool = True) -> list[tuple[str,str]]:
+import config
+from src.cache import Cache
+
+
+_session = None
+_session_lock = threading.Lock()
+
+TABLE_ID = 'supsystic-table-5'
+
+# one round trip for all the links of the table (or of the page of it that is shown) instead of 2 per link
+COLLECT_LINKS_SCRIPT = """table => Array.from(table.querySelectorAll('a'), a => [a.innerHTML, a.getAttribute('href')])"""
+
+# shows all the rows of the table on one page with the DataTables API. Returns false if the table isn't a DataTable (nothing to do)
+SHOW_ALL_ROWS_SCRIPT = """selector => {
+    const $ = window.jQuery;
+    if (!$ || !$.fn.dataTable || !$.fn.dataTable.isDataTable(selector)) return false;
+    $(selector).DataTable().page.len(-1).draw();
+    return true;
+}"""
+
+# signs in the HTML of the page that the table isn't all there: the number of rows of the whole table (the DataTables info text,
+# or the recordsTotal of its data), and server-side processing (the rows are fetched from the server a page at a time)
+TABLE_TOTAL_PATTERNS = [r'\bof\s+([\d,]+)\s+entries', r'["\']?(?:recordsTotal|iTotalRecords)["\']?\s*:\s*["\']?(\d+)']
+SERVER_SIDE_PATTERN = r'server[-_]?side(?:[-_]?processing)?["\']?\s*[:=]\s*["\']?(?:true|1|on|yes)\b'
+# number of rows on the first page of the table, if the page sets it (-1 is all of them)
+PAGE_LENGTH_PATTERN = r'["\']?(?:pageLength|iDisplayLength)["\']?\s*:\s*["\']?(-?\d+)'
+
+
+def collect_links(check_older_pages: bool = True, known_hrefs: set[str] = None, url: str = None, collector: str = None) -> list[tuple[str,str]]:
     """Collects links from the customs website.
+    With the 'auto' collector, the links are read from the HTML of the page unless it shows that they aren't the whole table
+    (server-side processing, or fewer rows than the table's total), or only the first page is wanted and the page doesn't say how many rows that is.
+    Then the page is rendered in the browser.
 
     Args:
         check_older_pages (bool, optional): If True, checks all the pages of the dynamic table for links. Defaults to True.
+        known_hrefs (set[str], optional): hrefs of links that are already known. The newest links are on the first page,
+            so once a page only has known links, the older pages aren't checked. Defaults to None (check all pages).
+        url (str, optional): page with the table of links (eg: a local copy of it). Defaults to config.exchange_rates_url.
+        collector (str, optional): 'http', 'browser' or 'auto' - see config.link_collector. Defaults to config.link_collector.
 
     Returns:
         list[tuple[str,str]]: list of collected links (each item is a tuple - (link name, link href))
     """
+    if url is None: url = config.exchange_rates_url
+    if collector is None: collector = config.link_collector
+    if collector not in ('http','browser','auto'): raise ValueError(f'Unknown link collector {collector!r}')
+
+    if collector == 'browser': return collect_links_with_browser(url, check_older_pages, known_hrefs)
+
+    try: links,problem,page_length = __read_table_html(url)
+    except requests.RequestException as e:
+        if collector == 'http': raise
+        links,problem,page_length = [], f'the exchange rates page could not be read over HTTP ({e})', None # eg: the website turns away clients that aren't browsers
+    # the whole table is read at once, so there are no older pages to skip - apart from when only the first page is wanted
+    if problem is None and not check_older_pages and page_length is None: problem = "the HTML doesn't say how many rows are on the first page of the table"
+    if problem is None or collector == 'http':
+        if problem is not None: print(f'{problem} - the links may not be the ones of the table')
+        return links if check_older_pages or page_length is None or page_length < 0 else links[:page_length]
+    print(f'{problem}, collecting the links with the browser')
+    return collect_links_with_browser(url, check_older_pages, known_hrefs)
+
+
+def collect_links_with_http(url: str, session: requests.Session = None) -> list[tuple[str,str]]:
+    """Collects the links of the table straight from the HTML of the page - no browser. When the table plugin puts all the rows in the HTML
+    and only paginates them in the browser, this gets the links of every page in one request (collect_links checks that it does).
+    Returns an empty list if the table isn't in the HTML (eg: if its rows are loaded by javascript).
+
+    Args:
+        url (str): page with the table of links
+        session (requests.Session, optional): session to download with. Defaults to the shared session from get_session().
+
+    Returns:
+        list[tuple[str,str]]: list of collected links (each item is a tuple - (link name, link href)), in the order of the table
+    """
+    return __read_table_html(url, session)[0]
+
+
+def collect_links_with_browser(url: str, check_older_pages: bool = True, known_hrefs: set[str] = None) -> list[tuple[str,str]]:
+    """Collects the links of the table by rendering the page in headless Chromium.
+    If the table is a DataTable, all its rows are shown on one page and read at once. Otherwise its pages are clicked through,
+    reading all the links of each page with one call. See collect_links for the arguments."""
+    from playwright.sync_api import sync_playwright # only imported if the browser is needed - most runs collect the links over plain HTTP
     all_links = []
-    
 
     with sync_playwright() as p:
-        
-        browser = p.chromium.launch()
+        browser = __launch_browser(p)
         page = browser.new_page()
-        page.goto("https://www.customs.gov.lk/exchange-rates/")
-        # print(page.title())
-        # page.screenshot(path="1.png")
-        # page.wait_for_timeout(10000)
-
-        # find the dynamic table next button
-        next_button = page.locator('#supsystic-table-5_next')
-        next_button_enabled = True
-
-        while next_button_enabled:
-            # check if the next button is enabled, or if the check_older_pages flag is False
-            if next_button.get_attribute('class') == 'paginate_button next disabled': next_button_enabled = False
-            if not check_older_pages: next_button_enabled = False
-            
-            # go to the dynamic table we are interested in
-            table = page.locator('#supsystic-table-5')
-
-            # collect the links currently visible in the dynamic table
-            table_links = table.locator('a').all()
-            for link in table_links:
-                link_label = link.inner_html()
-                link_href = link.get_attribute('href')
-                if 'http' not in link_href: # actually had to add this cuz some links didn't have it
-                    link_href = 'https://www.customs.gov.lk' + link_href
-                all_links.append((link_label,link_href))
-
-            if next_button_enabled: next_button.click()
-        
+        page.goto(url)
+        table = page.locator(f'#{TABLE_ID}')
+
+        if check_older_pages and page.evaluate(SHOW_ALL_ROWS_SCRIPT, f'#{TABLE_ID}'):
+            page.wait_for_load_state('networkidle') # in case the table gets its rows from the server
+            all_links = __get_links_of_table(table, url)
+        else:
+            # find the dynamic table next button
+            next_button = page.locator(f'#{TABLE_ID}_next')
+            next_button_enabled = True
+
+            while next_button_enabled:
+                # check if the next button is enabled, or if the check_older_pages flag is False
+                if next_button.count() == 0 or 'disabled' in (next_button.get_attribute('class') or '').split(): next_button_enabled = False
+                if not check_older_pages: next_button_enabled = False
+
+                # collect the links currently visible in the dynamic table
+                page_links = __get_links_of_table(table, url)
+                all_links.extend(page_links)
+
+                if known_hrefs is not None and all(link_href in known_hrefs for _,link_href in page_links): next_button_enabled = False
+
+                if next_button_enabled: next_button.click()
+
         browser.close()
 
     return all_links
 
-def download_pdf_as_bytesio(pdf_url: str) -> io.BytesIO:
+
+def install_browser():
+    """Installs the Chromium build that playwright drives (and the system libraries it needs). Only needed once per machine,
+    so it is done on the first failed launch (or with main.py --install-browsers) rather than on every run."""
+    subprocess.run(['playwright','install','chromium'])
+    subprocess.run(['playwright','install-deps']) # precaution - if runtime environment is something like a lightweight OS we might get the error "host system is missing dependencies to run browsers"
+
+
+def __launch_browser(p):
+    try:
+        return p.chromium.launch()
+    except Exception as e:
+        if 'playwright install' not in str(e): raise # only retry if the browser isn't installed
+        print('the playwright browser is not installed, installing it')
+        install_browser()
+        return p.chromium.launch()
+
+
+def __read_table_html(url: str, session: requests.Session = None) -> tuple[list[tuple[str,str]],str,int]:
+    """Reads the table of links from the HTML of the page (see collect_links_with_http) and checks whether that is the whole table:
+    it isn't if the page has server-side processing, or if the number of rows in the HTML isn't the table's total (when the page says what it is).
+
+    Returns:
+        tuple[list[tuple[str,str]],str,int]: the links, why they may not be all the links of the table (None if nothing says so),
+        and the number of rows on the first page of the table (None if the page doesn't say, -1 for all of them)
+    """
+    if session is None: session = get_session()
+    response = session.get(url, timeout=config.download_timeout)
+    response.raise_for_status()
+    parser = _TableLinkParser(TABLE_ID)
+    parser.feed(response.text)
+    parser.close()
+    links = [(label, urljoin(url, href)) for label,href in parser.links]
+
+    page_length = parser.table_attributes.get('data-page-length')
+    if page_length is None:
+        match = re.search(PAGE_LENGTH_PATTERN, response.text)
+        if match: page_length = match.group(1)
+    page_length = int(page_length) if page_length is not None and re.fullmatch(r'-?\d+', page_length.strip()) else None
+
+    totals = [int(match.group(1).replace(',','')) for pattern in TABLE_TOTAL_PATTERNS for match in re.finditer(pattern, response.text)]
+    problem = None
+    if re.search(SERVER_SIDE_PATTERN, response.text, re.IGNORECASE):
+        problem = 'the table gets its rows from the server'
+    elif len(links) == 0: problem = 'no links in the HTML of the exchange rates page'
+    elif totals and max(totals) != parser.row_count: problem = f'the HTML has {parser.row_count} of the {max(totals)} rows of the table'
+    return links, problem, page_length
+
+
+def __get_links_of_table(table, url: str) -> list[tuple[str,str]]:
+    # some links are relative to the website
+    return [(label, urljoin(url, href)) for label,href in table.evaluate(COLLECT_LINKS_SCRIPT) if href]
+
+
+class _TableLinkParser(HTMLParser):
+    """Gets (inner HTML, href) of the links inside the table with the given id, in the order they appear,
+    the attributes of the table and the number of its rows with data cells."""
+    def __init__(self, table_id: str) -> None:
+        super().__init__(convert_charrefs=False) # keep the entities as they are, like the innerHTML the browser gives
+        self.table_id = table_id
+        self.links = []
+        self.table_attributes = {} # attributes of the table tag
+        self.row_count = 0 # rows of the table with data cells (not the header)
+        self._row_counted = False
+        self._table_depth = 0 # tables nested in our table (and itself) that we are in
+        self._href = None
+        self._label_parts = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'table' and (self._table_depth > 0 or dict(attrs).get('id') == self.table_id):
+            if self._table_depth == 0: self.table_attributes = {name: value or '' for name,value in attrs}
+            self._table_depth += 1
+        if self._table_depth == 0: return
+        if self._table_depth == 1 and tag == 'tr': self._row_counted = False
+        if self._table_depth == 1 and tag == 'td' and not self._row_counted:
+            self.row_count += 1
+            self._row_counted = True
+        if tag == 'a' and self._label_parts is None:
+            self._href = dict(attrs).get('href')
+            self._label_parts = []
+        elif self._label_parts is not None:
+            self._label_parts.append(self.get_starttag_text())
+
+    def handle_endtag(self, tag):
+        if self._table_depth == 0: return
+        if tag == 'a' and self._label_parts is not None:
+            if self._href: self.links.append((''.join(self._label_parts), self._href))
+            self._href = None
+            self._label_parts = None
+        elif self._label_parts is not None:
+            self._label_parts.append(f'</{tag}>')
+        if tag == 'table': self._table_depth -= 1
+
+    def handle_data(self, data):
+        if self._label_parts is not None: self._label_parts.append(data)
+
+    def handle_entityref(self, name):
+        if self._label_parts is not None: self._label_parts.append(f'&{name};')
+
+    def handle_charref(self, name):
+        if self._label_parts is not None: self._label_parts.append(f'&#{name};')
+
+
+def get_session() -> requests.Session:
+    """Returns the shared requests session (created on first use). Connections are kept alive and pooled,
+    and failed requests (connection errors, 429 and 5xx responses) are retried with exponential backoff.
+
+    Returns:
+        requests.Session: the shared session
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(total=config.download_retries, backoff_factor=0.5, status_forcelist=[429,500,502,503,504], allowed_methods=['GET'])
+            adapter = HTTPAdapter(pool_connections=config.download_workers, pool_maxsize=config.download_workers, max_retries=retry)
+            _session = requests.Session()
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+    return _session
+
+def download_pdf_as_bytesio(pdf_url: str, session: requests.Session = None, cache: Cache = None, refresh: bool = False) -> io.BytesIO:
     """Downloads a PDF from the given URL to BytesIO
 
+    Published PDFs never change, so if a cache is given, a PDF already in it is returned without touching the network.
+    With refresh, the cached PDF is revalidated with the server instead (If-None-Match / If-Modified-Since), and only downloaded again if it changed.
+
     Args:
         pdf_url (str): URL
+        session (requests.Session, optional): session to download with. Defaults to the shared session from get_session().
+        cache (Cache, optional): cache to read the PDF from and store it in. Defaults to None (no caching).
+        refresh (bool, optional): revalidate cached PDFs with the server. Defaults to False.
+
+    Raises:
+        requests.HTTPError: if the server responds with an error that isn't retried (eg: 404)
+        requests.exceptions.RetryError: if the server still responds with 429 or a 5xx error after the retries
+        requests.ConnectionError, requests.Timeout: if the server still can't be reached, or is too slow, after the retries
 
     Returns:
         io.BytesIO: Downloaded PDF
     """
-    response = requests.get(pdf_url)
+    if session is None: session = get_session()
+    cache_key = f'pdf:{pdf_url}'
+    cached = cache.get(cache_key) if cache is not None else None
+    if cached is not None and not refresh: return io.BytesIO(cached[0])
+
+    headers = {}
+    if cached is not None:
+        if cached[1].get('etag'): headers['If-None-Match'] = cached[1]['etag']
+        if cached[1].get('last_modified'): headers['If-Modified-Since'] = cached[1]['last_modified']
+    response = session.get(pdf_url, timeout=config.download_timeout, headers=headers)
+    if response.status_code == 304 and cached is not None: return io.BytesIO(cached[0])
+    response.raise_for_status()
+
+    if cache is not None:
+        cache.put(cache_key, response.content, {'etag': response.headers.get('ETag'), 'last_modified': response.headers.get('Last-Modified')})
     pdf_bytes = io.BytesIO(response.content)
     return pdf_bytes
+
+def prefetch_pdfs(links: list[tuple[str,str]], queue_size: int = None, session: requests.Session = None,
+                  cache: Cache = None, refresh: bool = False) -> Iterator[tuple[str,str,io.BytesIO,str,float]]:
+    """Downloads the PDFs of the links in background threads, while the caller processes the ones already downloaded.
+    At most queue_size PDFs are downloaded ahead of the caller, so memory stays capped.
+    PDFs are yielded in the order of the links.
+
+    Args:
+        links (list[tuple[str,str]]): list of (link name, link href), as returned by collect_links
+        queue_size (int, optional): maximum number of PDFs downloaded (or downloading) ahead of the caller. Defaults to config.prefetch_queue_size.
+        session (requests.Session, optional): session to download with. Defaults to the shared session from get_session().
+        cache (Cache, optional): passed on to download_pdf_as_bytesio. Defaults to None (no caching).
+        refresh (bool, optional): passed on to download_pdf_as_bytesio. Defaults to False.
+
+    Yields:
+        tuple[str,str,io.BytesIO,str,float]: link name, link href, downloaded PDF (None if failed), error traceback (empty if OK), seconds taken to download
+    """
+    if len(links) == 0: return # eg: an incremental run with everything up to date. A pool of 0 download threads can't be made
+    if queue_size is None: queue_size = config.prefetch_queue_size
+    if session is None: session = get_session()
+
+    def download(pdf_link):
+        start = time.perf_counter()
+        try: return download_pdf_as_bytesio(pdf_link, session, cache, refresh), '', time.perf_counter() - start
+        except Exception: return None, traceback.format_exc(), time.perf_counter() - start
+
+    links = iter(links)
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=min(config.download_workers, queue_size), thread_name_prefix='download') as executor:
+        while True:
+            # keep the queue topped up
+            for name,pdf_link in links:
+                pending.append((name, pdf_link, executor.submit(download, pdf_link)))
+                if len(pending) >= queue_size: break
+            if len(pending) == 0: break
+            name,pdf_link,future = pending.popleft()
+            pdf_bytesio,error,seconds = future.result()
+            yield name,pdf_link,pdf_bytesio,error,seconds